@@ -1,66 +1,272 @@
+import asyncio
+import logging
 import os
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import date, timedelta
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 
-from linebot import LineBotApi, WebhookParser
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import (
-    MessageEvent,
-    TextMessage,
-    TextSendMessage,
-    FlexSendMessage,
-    PostbackEvent,
-    QuickReply,
-    QuickReplyButton,
-    MessageAction,
-)
 
 # ===== DB =====
 from db import (
     init_db,
-    get_available_dates,
-    get_available_slots_by_date,
+    availability_cache,
+    availability_version,
+    get_available_dates_page,
     get_all_slots_by_date,
-    get_user_booked_slots,
+    get_slot,
     book_slot,
-    cancel_slot_by_time,
+    hold_slot,
+    release_hold,
+    sweep_expired_holds,
+    cancel_booking,
     get_open_status_for_range,
 )
 
 # ===== Flex =====
+from date_labels import parse_date, weekday_name
+from render_cache import RenderCache
 from flex_day_slots import build_day_slots
 from flex_confirm import build_confirm_flex
 from flex_date_picker import build_date_picker
+from flex import build_date_carousel
 from flex_coach_day import build_coach_day_flex
 from flex_cancel_confirm import build_cancel_confirm_flex
 from flex_cancel_list import build_cancel_list_flex
 
+# ===== 時段 =====
+from generate_slots import ensure_rolling_window
+
+# ===== Worker =====
+from snapshot import DeliverySnapshot, available_slots, booked_slots, use_snapshot
+from event_queue import EventDispatcher, DispatcherBusy
+from event_dedup import EventDeduplicator
+
+# ===== LINE API / Tenant =====
+from line_client import RawMessage, text_message, flex_message, quick_reply
+from line_events import WebhookEvent, parse_events
+from outbox import run_drainer
+from tenants import DEFAULT_TENANT, load_tenants
+
+# ===== 路由 =====
+from router import (
+    Router,
+    DatePayload,
+    DatePagePayload,
+    DayPagePayload,
+    SlotPayload,
+    BackPayload,
+    args_payload,
+)
+
+# ===== Metrics / Tracing =====
+import metrics
+import tracing
+
 # ================= 初始化 =================
 load_dotenv()
+logger = logging.getLogger(__name__)
+tracing.load_settings()
+
+# 每個教練 / 場館一個 tenant，各自的 channel 走 /webhook/<tenant>（default 也可以走 /webhook）
+TENANTS = load_tenants()
+
 print("🚀 calling init_db")
-init_db()
+for tenant_key in TENANTS:
+    init_db(tenant_key)
+
+# SLOT_ROLLING_WEEKS=N：啟動時補齊從今天起 N 週的時段（冪等，每次部署都可以跑）
+SLOT_ROLLING_WEEKS = int(os.getenv("SLOT_ROLLING_WEEKS", "0"))
+if SLOT_ROLLING_WEEKS > 0:
+    for tenant_key in TENANTS:
+        inserted, skipped = ensure_rolling_window(SLOT_ROLLING_WEEKS, tenant=tenant_key)
+        print(f"🗓 [{tenant_key}] rolling window {SLOT_ROLLING_WEEKS} 週：新增 {inserted}，略過 {skipped}")
+
+# WEBHOOK_ASYNC=1：webhook 驗簽後把事件丟進背景 worker，立刻回 200
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+# WEBHOOK_WORKERS：同時處理的事件數上限（同一位學員的事件仍依序處理）
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "32"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+WEBHOOK_PUT_TIMEOUT = float(os.getenv("WEBHOOK_PUT_TIMEOUT", "5"))
+
+# WEBHOOK_DEDUP=1：依 webhookEventId 丟掉 LINE 重送的事件（TTL 預設一天）
+WEBHOOK_DEDUP = os.getenv("WEBHOOK_DEDUP", "1") == "1"
+WEBHOOK_DEDUP_SIZE = int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000"))
+WEBHOOK_DEDUP_TTL = float(os.getenv("WEBHOOK_DEDUP_TTL", "86400"))
+
+# RENDER_CACHE_SIZE：Flex render 快取的筆數上限（0 = 不快取）
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "1024"))
+
+# 分頁：date picker 一頁幾天（超過一頁就改用 carousel，每張 bubble 7 天，最多 12 張），選時段一頁幾堂
+DATE_PAGE_SIZE = min(int(os.getenv("DATE_PAGE_SIZE", "21")), 7 * 12)
+SLOT_PAGE_SIZE = int(os.getenv("SLOT_PAGE_SIZE", "10"))
+
+# OUTBOX_DRAINER=1：在背景送出 outbox 裡的 push（教練通知、提醒重試）
+OUTBOX_DRAINER = os.getenv("OUTBOX_DRAINER", "1") == "1"
+
+# 過期暫留的清理間隔（秒）；訂位 / 暫留時也會順手清
+HOLD_SWEEP_INTERVAL = float(os.getenv("HOLD_SWEEP_INTERVAL", "30"))
+
+# ================= Metrics =================
 
-app = FastAPI()
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
-parser = WebhookParser(os.getenv("LINE_CHANNEL_SECRET"))
+EVENT_SECONDS = metrics.histogram(
+    "bot_event_seconds", "單一事件的處理時間（handler + reply）", ["tenant", "kind", "command"]
+)
+WEBHOOK_SECONDS = metrics.histogram("bot_webhook_seconds", "webhook 請求的時間", ["tenant"])
+BOOKING_CONFLICTS = metrics.counter(
+    "bot_booking_conflicts_total", "時段已額滿 / 被暫留而訂不到的次數", ["tenant", "stage"]
+)
+
+
+def command_label(event):
+    """(kind, command) 給 metrics 用；label 只用路由表裡有的指令，其他都算 other"""
+    if event.data is not None:
+        return "postback", postbacks.label(event.data)
+    if event.text is not None:
+        return "message", messages.label(event.text.strip())
+    return "event", event.type
+
+# ================= Lifespan =================
+
+
+async def process_event(item):
+    """
+    單一事件的處理入口（同步 / 背景模式共用），item = (tenant, event, snapshot)
+    handler 只查 DB、組訊息並回傳（sqlite 是阻塞呼叫，丟到 threadpool），
+    回覆由 tenant 的 async client 送出，不卡 event loop
+    snapshot 是同一個 webhook 先一起查好的資料（可能是 None）
+    """
+    tenant, event, snapshot = item
+    kind, command = command_label(event)
+    profile = tracing.should_profile((tenant.key, event.webhook_event_id))
+    with EVENT_SECONDS.time(tenant.key, kind, command), tracing.trace(
+        "event", profile=profile, tenant=tenant.key, kind=kind, command=command,
+        event_id=event.webhook_event_id,
+    ), use_snapshot(snapshot):
+        await handle_event(tenant, event)
+
+
+async def handle_event(tenant, event):
+    user_id = event.user_id
+    message = None
+
+    try:
+        if event.data is not None:
+            message = await run_in_threadpool(handle_postback, event, user_id, tenant)
+        elif event.text is not None:
+            message = await run_in_threadpool(handle_message, event, user_id, tenant)
+    except Exception:
+        # 沒處理完，讓 LINE 重送時可以再處理一次
+        if dedup and event.webhook_event_id:
+            await run_in_threadpool(dedup.forget, tenant.key, event.webhook_event_id)
+        raise
+
+    if message:
+        await tenant.line_client.reply_message(event.reply_token, message)
+
+
+dedup = EventDeduplicator(
+    max_size=WEBHOOK_DEDUP_SIZE,
+    ttl=WEBHOOK_DEDUP_TTL,
+) if WEBHOOK_DEDUP else None
+
+
+async def drop_redeliveries(tenant, events):
+    """已經處理過的 webhookEventId 直接丟掉；本 worker 收過的查 LRU 就好，不碰 DB"""
+    pending = [
+        e for e in events
+        if not e.webhook_event_id or not dedup.is_recent(tenant.key, e.webhook_event_id)
+    ]
+    event_ids = [e.webhook_event_id for e in pending if e.webhook_event_id]
+    if not event_ids:
+        return pending
+
+    claimed = await run_in_threadpool(dedup.claim, tenant.key, event_ids)
+    return [e for e in pending if not e.webhook_event_id or e.webhook_event_id in claimed]
+
+
+async def forget_unprocessed(tenant, events):
+    """
+    claim 過、但這次沒處理 / 沒排進 queue 的事件取消紀錄
+    webhook 回非 2xx 時 LINE 會整包重送，沒取消的話這些事件會被當成重送丟掉
+    """
+    event_ids = [e.webhook_event_id for e in events if e.webhook_event_id]
+    if dedup and event_ids:
+        await run_in_threadpool(dedup.forget, tenant.key, *event_ids)
+
+
+metrics.gauge(
+    "bot_availability_cache", "可預約快取的命中 / 未命中 / 作廢次數（累計）", ["tenant", "result"],
+    lambda: {
+        (key, result): availability_cache(key).stats()[result]
+        for key in TENANTS for result in ("hits", "misses", "invalidations")
+    },
+)
+render_cache = RenderCache(max_size=RENDER_CACHE_SIZE)
+
+metrics.gauge(
+    "bot_render_cache", "Flex render 快取的命中 / 未命中次數（累計）", ["result"],
+    lambda: {(result,): render_cache.stats()[result] for result in ("hits", "misses")},
+)
+metrics.gauge(
+    "bot_webhook_duplicates", "去重丟掉的重送事件數", [],
+    lambda: {(): dedup.duplicates} if dedup else {},
+)
+metrics.gauge(
+    "bot_event_queue_depth", "背景 worker 佇列裡等待中的事件數", [],
+    lambda: {(): dispatcher.qsize()} if dispatcher else {},
+)
 
-# ================= 狀態 =================
-USER_SLOT_CACHE = {}
 
-COACH_IDS = {
-    "U17fdee62c51888ebea77d8b696eb38e4",
-}
+async def run_hold_sweeper(tenant_key, interval=HOLD_SWEEP_INTERVAL):
+    """定期把過期的暫留還回名額，沒人訂位時時段也會重新出現"""
+    while True:
+        try:
+            await asyncio.to_thread(sweep_expired_holds, tenant_key)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("hold sweep failed")
+        await asyncio.sleep(interval)
+
+
+dispatcher = EventDispatcher(
+    process_event,
+    workers=WEBHOOK_WORKERS,
+    queue_size=WEBHOOK_QUEUE_SIZE,
+    put_timeout=WEBHOOK_PUT_TIMEOUT,
+) if WEBHOOK_ASYNC else None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if dispatcher:
+        await dispatcher.start()
+    tasks = [
+        asyncio.create_task(run_drainer(t.line_client, tenant=t.key))
+        for t in TENANTS.values()
+    ] if OUTBOX_DRAINER else []
+    tasks += [asyncio.create_task(run_hold_sweeper(key)) for key in TENANTS]
+    yield
+    if dispatcher:
+        await dispatcher.stop()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for t in TENANTS.values():
+        await t.line_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ================= Quick Reply =================
 
 
 def main_quick_reply():
-    return QuickReply(items=[
-        QuickReplyButton(action=MessageAction(label="📅 預約", text="預約")),
-        QuickReplyButton(action=MessageAction(label="❌ 取消", text="取消")),
-    ])
+    return quick_reply(("📅 預約", "預約"), ("❌ 取消", "取消"))
 
 # ================= Health =================
 
@@ -70,192 +276,350 @@ def main_quick_reply():
 async def health():
     return PlainTextResponse("ok")
 
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/debug/tracing")
+async def debug_tracing(request: Request, slow_ms: float = None, profile_every: int = None):
+    """執行中調整慢事件門檻 / profile 抽樣率（只影響收到這個請求的 worker），要帶 X-Profile-Token"""
+    if not tracing.check_token(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return tracing.configure(slow_ms=slow_ms, profile_every=profile_every)
+
 # ================= Webhook =================
 
 
 @app.post("/webhook")
 async def webhook(request: Request):
+    return await handle_webhook(request, TENANTS[DEFAULT_TENANT])
+
+
+@app.post("/webhook/{tenant_key}")
+async def tenant_webhook(tenant_key: str, request: Request):
+    tenant = TENANTS.get(tenant_key)
+    if tenant is None:
+        raise HTTPException(status_code=404, detail="Unknown tenant")
+    return await handle_webhook(request, tenant)
+
+
+async def handle_webhook(request: Request, tenant):
+    with WEBHOOK_SECONDS.time(tenant.key), tracing.trace("webhook", tenant=tenant.key):
+        return await _handle_webhook(request, tenant)
+
+
+async def _handle_webhook(request: Request, tenant):
     signature = request.headers.get("x-line-signature")
     if not signature:
         raise HTTPException(status_code=400, detail="Missing signature")
 
-    body = (await request.body()).decode("utf-8")
+    body = await request.body()
 
     try:
-        events = parser.parse(body, signature)
+        with tracing.span("parse"):
+            events = parse_events(body, signature, tenant.channel_secret)
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    for event in events:
-        user_id = event.source.user_id
-
-        if isinstance(event, PostbackEvent):
-            handle_postback(event, user_id)
-            continue
-
-        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
-            handle_message(event, user_id)
-            continue
+    if dedup:
+        with tracing.span("dedup"):
+            events = await drop_redeliveries(tenant, events)
+
+    # X-Profile: <PROFILE_TOKEN> 指定這次的事件都要 profile（背景模式也一樣）
+    if tracing.check_token(request.headers.get("x-profile")):
+        for event in events:
+            tracing.force_profile((tenant.key, event.webhook_event_id))
+
+    # 多個事件時先把它們要讀的資料一起查好
+    snapshot = None
+    if len(events) > 1:
+        with tracing.span("prefetch"):
+            snapshot = await run_in_threadpool(DeliverySnapshot.load, tenant.key, events)
+
+    for i, event in enumerate(events):
+        try:
+            if dispatcher:
+                await dispatcher.submit(f"{tenant.key}:{event.user_id}", (tenant, event, snapshot))
+                continue
+
+            with tracing.span("events"):
+                await process_event((tenant, event, snapshot))
+        except DispatcherBusy:
+            # 回壓：非 2xx 讓 LINE 稍後重送；這個和後面還沒排進去的都要能再處理
+            await forget_unprocessed(tenant, events[i:])
+            raise HTTPException(status_code=503, detail="Busy")
+        except Exception:
+            # 這個事件 handle_event 已經 forget 了，後面的還沒處理
+            await forget_unprocessed(tenant, events[i + 1:])
+            raise
 
     return "OK"
 
 # ================= Message Handler =================
 
 
-def handle_message(event: MessageEvent, user_id: str):
-    text = event.message.text.strip()
-
-    # ===== 教練：未來課表 =====
-    if user_id in COACH_IDS and text.startswith("課表"):
-        parts = text.split()
-        days = 14
-        if len(parts) == 2:
-            try:
-                days = int(parts[1])
-            except ValueError:
-                reply_text(event, "用法：課表 或 課表 14")
-                return
-
-        rows = get_open_status_for_range(days)
-        lines = [f"📅 未來 {days} 天課表狀態\n"]
-
-        for date_str, status, source in rows:
-            dt = datetime.strptime(date_str, "%Y-%m-%d")
-            weekday = "一二三四五六日"[dt.weekday()]
-            icon = "🔓" if status == "open" and source == "override" else "✅" if status == "open" else "❌"
-            lines.append(f"{dt.month:02}/{dt.day:02}（{weekday}） {icon}")
-
-        reply_text(event, "\n".join(lines))
-        return
-
-    # ===== 教練：查課 =====
-    if user_id in COACH_IDS and text.startswith("查課"):
-        parts = text.split()
-        if len(parts) != 2:
-            reply_text(event, "用法：查課 YYYY-MM-DD")
-            return
-
-        slots = get_all_slots_by_date(parts[1])
-        if not slots:
-            reply_text(event, f"{parts[1]} 沒有任何課程")
-            return
-
-        flex = FlexSendMessage(
-            alt_text="課表",
-            contents=build_coach_day_flex(parts[1], slots)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # ===== 預約 =====
-    if text == "預約":
-        dates = get_available_dates()
-        if not dates:
-            reply_text(event, "目前沒有可預約的日期 😢")
-            return
-
-        flex = FlexSendMessage(
-            alt_text="請選擇日期",
-            contents=build_date_picker(dates)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # ===== 取消 =====
-    if text == "取消":
-        slots = get_user_booked_slots(user_id)
-        if not slots:
-            reply_text(event, "你目前沒有已預約的課程")
-            return
-
-        flex = FlexSendMessage(
-            alt_text="取消預約",
-            contents=build_cancel_list_flex(slots)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # fallback
-    line_bot_api.reply_message(
-        event.reply_token,
-        TextSendMessage(text="請選擇功能 👇", quick_reply=main_quick_reply())
-    )
+def main_menu(user_id, tenant):
+    return text_message("請選擇功能 👇", quick_reply=main_quick_reply())
+
+
+messages = Router("message", fallback=main_menu)
+
+
+def handle_message(event: WebhookEvent, user_id: str, tenant):
+    """回傳要回覆的訊息，不需要回覆時回傳 None"""
+    return messages.dispatch(event.text.strip(), user_id, tenant)
+
+
+# ===== 教練：未來課表 =====
+@messages.route("課表", decode=args_payload, coach_only=True)
+def show_open_status(args, user_id, tenant):
+    days = 14
+    if len(args) == 1:
+        try:
+            days = int(args[0])
+        except ValueError:
+            return text_message("用法：課表 或 課表 14")
+
+    rows = get_open_status_for_range(days, open_weekdays=tenant.open_weekdays, tenant=tenant.key)
+    lines = [f"📅 未來 {days} 天課表狀態\n"]
+
+    for date_str, status, source in rows:
+        dt = parse_date(date_str)
+        icon = "🔓" if status == "open" and source == "override" else "✅" if status == "open" else "❌"
+        lines.append(f"{dt.month:02}/{dt.day:02}（{weekday_name(date_str)}） {icon}")
+
+    return text_message("\n".join(lines))
+
+
+# ===== 教練：查課 =====
+@messages.route("查課", decode=args_payload, coach_only=True)
+def show_coach_day(args, user_id, tenant):
+    if len(args) != 1:
+        return text_message("用法：查課 YYYY-MM-DD")
+    return coach_day_message(args[0], tenant)
+
+
+# ===== 預約 =====
+@messages.route("預約")
+def start_booking(_, user_id, tenant):
+    return date_picker_message(tenant)
+
+
+# ===== 取消 =====
+@messages.route("取消")
+def start_cancel(_, user_id, tenant):
+    slots = booked_slots(user_id, tenant.key)
+    if not slots:
+        return text_message("你目前沒有已預約的課程")
+
+    return flex_message("取消預約", build_cancel_list_flex(slots))
 
 # ================= Postback Handler =================
 
 
-def handle_postback(event: PostbackEvent, user_id: str):
-    data = event.postback.data
-
-    # 選日期
-    if data.startswith("DATE|"):
-        date = data.split("|", 1)[1]
-        slots = get_available_slots_by_date(date)
-
-        if not slots:
-            reply_text(event, f"{date} 沒有可預約的時段")
-            return
-
-        flex = FlexSendMessage(
-            alt_text="可預約時段",
-            contents=build_day_slots(date, slots)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # 選時段
-    if data.startswith("SLOT|"):
-        slot_id = data.split("|", 1)[1]
-        date, time_range = slot_id.split("T", 1)
-        start, end = time_range.split("-", 1)
-
-        USER_SLOT_CACHE[user_id] = slot_id
-
-        flex = FlexSendMessage(
-            alt_text="確認預約",
-            contents=build_confirm_flex(slot_id, date, start, end)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # 確認預約
-    if data.startswith("CONFIRM|"):
-        slot_id = data.split("|", 1)[1]
-        success = book_slot(slot_id, user_id)
-        USER_SLOT_CACHE.pop(user_id, None)
-
-        reply_text(
-            event,
-            f"✅ 預約成功！\n{slot_id.replace('T', ' ')}" if success else "❌ 此時段已被其他人預約"
-        )
-        return
-
-    # ===== 取消流程 =====
-
-    # 預覽取消
-    if data.startswith("CANCEL_PREVIEW|"):
-        _, date, start, end = data.split("|", 3)
-
-        flex = FlexSendMessage(
-            alt_text="確認取消",
-            contents=build_cancel_confirm_flex(date, start, end)
-        )
-        line_bot_api.reply_message(event.reply_token, flex)
-        return
-
-    # 確認取消
-    if data.startswith("CANCEL_CONFIRM|"):
-        _, date, start, end = data.split("|", 3)
-
-        success = cancel_slot_by_time(date, start, end, user_id)
-        reply_text(
-            event,
-            f"❌ 已取消 {date} {start}-{end}" if success else "⚠️ 取消失敗，可能已取消或非你的預約"
-        )
-        return
+postbacks = Router("postback", separator="|")
+
+
+def handle_postback(event: WebhookEvent, user_id: str, tenant):
+    """回傳要回覆的訊息，不需要回覆時回傳 None"""
+    return postbacks.dispatch(event.data, user_id, tenant)
+
+
+# 選日期
+@postbacks.route("DATE", decode=DatePayload.decode)
+def choose_date(p, user_id, tenant):
+    return day_slots_message(p.date, tenant)
+
+
+# 選時段的下一頁
+@postbacks.route("DAY_PAGE", decode=DayPagePayload.decode)
+def choose_date_page(p, user_id, tenant):
+    return day_slots_message(p.date, tenant, after=p.after)
+
+
+# date picker 的下一頁 / 回第一頁
+@postbacks.route("DATE_PAGE", decode=DatePagePayload.decode)
+def date_page(p, user_id, tenant):
+    return date_picker_message(tenant, page=p.page, after=p.after)
+
+
+# 選時段
+@postbacks.route("SLOT", decode=SlotPayload.decode)
+def choose_slot(p, user_id, tenant):
+    slot = get_slot(p.slot, tenant=tenant.key)
+
+    # 先暫留名額，確認前別人選不到
+    if slot is None or not hold_slot(slot, user_id, tenant=tenant.key):
+        BOOKING_CONFLICTS.inc(tenant.key, "hold")
+        return text_message("❌ 此時段已額滿或你已預約過")
+
+    # sid 只在同一個 DB 裡唯一，key 要帶 tenant
+    key = ("confirm", tenant.key, slot[0])
+    return render_cache.get(key) or render_cache.put(
+        key, flex_message("確認預約", build_confirm_flex(*slot))
+    )
+
+
+# 確認預約
+@postbacks.route("CONFIRM", decode=SlotPayload.decode)
+def confirm_booking(p, user_id, tenant):
+    slot = get_slot(p.slot, tenant=tenant.key)
+    if slot is None:
+        BOOKING_CONFLICTS.inc(tenant.key, "confirm")
+        return text_message("❌ 此時段已額滿或你已預約過")
+
+    _, day, start, end = slot
+    label = f"{day} {start}-{end}"
+    success = book_slot(
+        slot,
+        user_id,
+        notify=coach_notifications(tenant, f"🆕 新預約\n{label}"),
+        tenant=tenant.key,
+    )
+    if not success:
+        BOOKING_CONFLICTS.inc(tenant.key, "confirm")
+
+    return text_message(
+        f"✅ 預約成功！\n{label}" if success else "❌ 此時段已額滿或你已預約過"
+    )
+
+
+# 上一步：放掉暫留，回到選日期
+@postbacks.route("BACK", decode=BackPayload.decode)
+def go_back(p, user_id, tenant):
+    release_hold(user_id, tenant=tenant.key)
+    return date_picker_message(tenant)
+
+# ===== 取消流程 =====
+
+
+# 預覽取消
+@postbacks.route("CANCEL_PREVIEW", decode=SlotPayload.decode)
+def preview_cancel(p, user_id, tenant):
+    slot = get_slot(p.slot, tenant=tenant.key)
+    if slot is None:
+        return text_message("⚠️ 找不到這堂課，可能已經取消")
+    return flex_message("確認取消", build_cancel_confirm_flex(*slot))
+
+
+# 確認取消
+@postbacks.route("CANCEL_CONFIRM", decode=SlotPayload.decode)
+def confirm_cancel(p, user_id, tenant):
+    slot = get_slot(p.slot, tenant=tenant.key)
+    if slot is None:
+        return text_message("⚠️ 取消失敗，可能已取消或非你的預約")
+
+    _, day, start, end = slot
+    success = cancel_booking(
+        slot, user_id,
+        notify=coach_notifications(tenant, f"🗑 預約已取消\n{day} {start}-{end}"),
+        tenant=tenant.key,
+    )
+    return text_message(
+        f"❌ 已取消 {day} {start}-{end}" if success else "⚠️ 取消失敗，可能已取消或非你的預約"
+    )
+
+# ===== 上課提醒的按鈕 =====
+
+
+# 取消：走一般的取消確認
+@postbacks.route("REMINDER_CANCEL", decode=SlotPayload.decode)
+def reminder_cancel(p, user_id, tenant):
+    return preview_cancel(p, user_id, tenant)
+
+
+# 改期：先訂新的，原本的讓學員自己取消（不會兩邊都沒訂到）
+@postbacks.route("REMINDER_RESCHEDULE", decode=SlotPayload.decode)
+def reminder_reschedule(p, user_id, tenant):
+    picker = date_picker_message(tenant)
+    slot = get_slot(p.slot, tenant=tenant.key)
+    if slot is None or not isinstance(picker, RawMessage):   # 原本的課不在了 / 沒有可預約日期，只有文字
+        return picker
+
+    _, day, start, end = slot
+    return [
+        text_message(f"🔄 改期：先選新的時段，預約成功後再輸入「取消」取消原本的 {day} {start}-{end}"),
+        picker,
+    ]
+
+
+# 教練：明天課表提醒的「查看明天詳細課表」
+@postbacks.route("COACH_VIEW_TOMORROW", coach_only=True)
+def coach_view_tomorrow(_, user_id, tenant):
+    return coach_day_message((date.today() + timedelta(days=1)).isoformat(), tenant)
+
+# ================= 共用回覆 =================
+
+
+def date_picker_message(tenant, page=1, after=None):
+    """
+    只查、只畫這一頁：after 是上一頁最後一天（keyset），一頁裝得下就維持原本的單張 bubble
+    """
+    # 「今天 / 明天」提示和可選的日期都跟著日期變，today 放進 key，過午夜自然換新
+    today = date.today()
+    key = ("date_picker", tenant.key, availability_version(tenant.key), today, page, after)
+    cached = render_cache.get(key)
+    if cached:
+        return cached
+
+    dates, has_more = get_available_dates_page(
+        tenant.open_weekdays, after=after, limit=DATE_PAGE_SIZE, tenant=tenant.key
+    )
+    if not dates and after:
+        # 按鈕是舊的，後面的日期已經訂滿 / 過期：回第一頁
+        return date_picker_message(tenant)
+    if not dates:
+        return text_message("目前沒有可預約的日期 😢")
+
+    if page == 1 and not has_more:
+        contents = build_date_picker(dates, today)
+    else:
+        contents = build_date_carousel(dates, page, dates[-1] if has_more else None, today)
+    return render_cache.put(key, flex_message("請選擇日期", contents))
+
+
+def day_slots_message(day, tenant, after=None):
+    """當天的時段，一頁 SLOT_PAGE_SIZE 堂；after 是上一頁最後一堂的 start"""
+    # version 要在讀資料之前拿；之後有寫入就換 key，不會回舊的畫面
+    key = ("day_slots", tenant.key, day, availability_version(tenant.key), after)
+    cached = render_cache.get(key)
+    if cached:
+        return cached
+
+    slots = available_slots(day, tenant.key)
+
+    if not slots:
+        return text_message(f"{day} 沒有可預約的時段")
+
+    # slots 依 start_time 排好，從 cursor 之後接著列；cursor 之後都沒了就回第一頁
+    start = next((i for i, slot in enumerate(slots) if slot[1] > after), len(slots)) if after else 0
+    if start == len(slots):
+        after, start = None, 0
+    page = slots[start:start + SLOT_PAGE_SIZE]
+    has_more = start + SLOT_PAGE_SIZE < len(slots)
+
+    return render_cache.put(key, flex_message("可預約時段", build_day_slots(
+        day, page, next_cursor=page[-1][1] if has_more else None, first_page=after is None,
+    )))
+
+
+def coach_day_message(day, tenant):
+    key = ("coach_day", tenant.key, day, availability_version(tenant.key))
+    cached = render_cache.get(key)
+    if cached:
+        return cached
+
+    slots = get_all_slots_by_date(day, tenant=tenant.key)
+    if not slots:
+        return text_message(f"{day} 沒有任何課程")
+
+    return render_cache.put(key, flex_message("課表", build_coach_day_flex(day, slots)))
 
 # ================= Utils =================
 
 
-def reply_text(event, text: str):
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
+def coach_notifications(tenant, text: str):
+    """給 book_slot / cancel_booking 的 notify：tenant 的每位教練一則 push"""
+    return [(coach_id, text_message(text), None) for coach_id in tenant.coach_ids]
@@ -0,0 +1,119 @@
+import threading
+
+
+class AvailabilityCache:
+    """
+    可預約資料的 in-process read-through 快取
+
+    - slots：date -> 當天可預約時段
+    - dates：開課星期規則 -> 可預約日期列表
+    - 只有寫入路徑（訂 / 取消 / 產生時段 / 改 override）會呼叫 invalidate
+    - 讀 DB 途中如果有人 invalidate，讀到的結果不會寫進快取（用 version 判斷）
+    - 別的 worker 寫入的部分由 sync_generation 處理：DB 的 generation 變了就全部作廢
+    """
+
+    def __init__(self, max_dates=512, enabled=True):
+        self.max_dates = max_dates
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._slots = {}
+        self._dates = {}
+        self._version = 0
+        self.generation = None
+        self._lock = threading.Lock()
+
+    def get_slots(self, date, loader):
+        return self._get(self._slots, date, loader)
+
+    def get_slots_many(self, dates, loader):
+        """多天一起取，回傳 {date: value}；快取裡沒有的交給 loader(缺的日期) 一次載入"""
+        dates = list(dict.fromkeys(dates))
+        if not self.enabled:
+            return loader(dates)
+
+        with self._lock:
+            found = {d: self._slots[d] for d in dates if d in self._slots}
+            missing = [d for d in dates if d not in found]
+            self.hits += len(found)
+            self.misses += len(missing)
+            version = self._version
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                if self._version == version:
+                    for d, value in loaded.items():
+                        self._store(self._slots, d, value)
+            found.update(loaded)
+        return found
+
+    def get_dates(self, rule, loader):
+        return self._get(self._dates, rule, loader)
+
+    def invalidate(self, *dates):
+        """某幾天的可預約狀態變了；日期列表一律一起丟掉"""
+        with self._lock:
+            self._version += 1
+            self.invalidations += 1
+            for d in dates:
+                self._slots.pop(d, None)
+            self._dates.clear()
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self.invalidations += 1
+            self._slots.clear()
+            self._dates.clear()
+
+    def sync_generation(self, generation):
+        """DB 的 generation 和上次看到的不同，代表有其他連線寫過，整個作廢"""
+        with self._lock:
+            if generation == self.generation:
+                return
+            self.generation = generation
+            self._version += 1
+            self.invalidations += 1
+            self._slots.clear()
+            self._dates.clear()
+
+    @property
+    def version(self):
+        """每次作廢都會 +1；呼叫端可以拿來判斷自己手上的資料讀完之後有沒有人寫過"""
+        return self._version
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "generation": self.generation,
+                "dates_cached": len(self._slots),
+            }
+
+    def _get(self, store, key, loader):
+        if not self.enabled:
+            return loader()
+
+        with self._lock:
+            if key in store:
+                self.hits += 1
+                return store[key]
+            self.misses += 1
+            version = self._version
+
+        value = loader()
+
+        with self._lock:
+            if self._version == version:
+                self._store(store, key, value)
+        return value
+
+    def _store(self, store, key, value):
+        if len(self._slots) >= self.max_dates and store is self._slots and key not in store:
+            # 超過上限就丟掉最早放進來的那天
+            self._slots.pop(next(iter(self._slots)))
+        store[key] = value
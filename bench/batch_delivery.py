@@ -0,0 +1,122 @@
+"""
+一個 webhook 帶很多事件時的 DB 查詢次數：逐一查 vs 先用 DeliverySnapshot 一起查
+
+    python -m bench.batch_delivery --events 40 --dates 5 --users 10
+
+事件一半是 DATE|<date>、一半是「取消」，分散在 --dates 個日期 / --users 位學員；
+快取開 / 關各跑一次，先確認兩種方式讀到的資料相同（不同就 exit 1），再比 SQL 數和時間
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import db
+from generate_slots import generate_slots
+from line_events import WebhookEvent
+from snapshot import DeliverySnapshot, available_slots, booked_slots, use_snapshot
+
+
+def make_events(count, dates, users):
+    events = []
+    for i in range(count):
+        user_id = f"U{i % users:04}"
+        if i % 2:
+            events.append(WebhookEvent("postback", f"E{i}", f"R{i}", user_id, data=f"DATE|{dates[i % len(dates)]}"))
+        else:
+            events.append(WebhookEvent("message", f"E{i}", f"R{i}", user_id, text="取消"))
+    return events
+
+
+def read_all(events):
+    """handler 會做的讀取"""
+    out = []
+    for event in events:
+        if event.data is not None:
+            out.append(available_slots(event.data.split("|", 1)[1], db.DEFAULT_TENANT))
+        else:
+            out.append(booked_slots(event.user_id, db.DEFAULT_TENANT))
+    return out
+
+
+def per_event(events):
+    return read_all(events)
+
+
+def batched(events):
+    with use_snapshot(DeliverySnapshot.load(db.DEFAULT_TENANT, events)):
+        return read_all(events)
+
+
+def count_selects(fn, events):
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(events)
+    finally:
+        conn.set_trace_callback(None)
+    return sum(1 for s in statements if s.lstrip().upper().startswith("SELECT"))
+
+
+def timed_run(fn, events, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn(events)
+    return (time.perf_counter() - t0) / iterations
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=40, help="一個 webhook 的事件數")
+    ap.add_argument("--dates", type=int, default=5, help="不重複的日期數")
+    ap.add_argument("--users", type=int, default=10, help="不重複的學員數")
+    ap.add_argument("--iterations", type=int, default=200)
+    args = ap.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "batch.db")
+        db.init_db()
+        generate_slots(weeks=4)
+        dates = db.get_available_dates()[:args.dates]
+
+        # 每位學員訂兩堂（還有空位的話）
+        for u in range(args.users):
+            for k in range(2):
+                d = dates[(u + k) % len(dates)]
+                slots = db.get_available_slots_by_date(d)
+                if slots:
+                    db.book_slot(slots[0][5], f"U{u:04}")
+
+        events = make_events(args.events, dates, args.users)
+        cache = db.availability_cache()
+
+        for enabled in (False, True):
+            cache.enabled = enabled
+            cache.clear()
+            if per_event(events) != batched(events):
+                print(f"FAIL cache={'on' if enabled else 'off'}：兩種方式讀到的資料不同")
+                failures += 1
+
+            cache.clear()
+            selects_single = count_selects(per_event, events)
+            cache.clear()
+            selects_batch = count_selects(batched, events)
+            single = timed_run(per_event, events, args.iterations)
+            batch = timed_run(batched, events, args.iterations)
+            print(
+                f"cache {'on ' if enabled else 'off'}  {args.events} events / {len(dates)} dates / {args.users} users  "
+                f"SELECT {selects_single:>3} -> {selects_batch:>3}  "
+                f"{single * 1000:.2f} ms -> {batch * 1000:.2f} ms per delivery"
+            )
+
+        db.close_connections()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
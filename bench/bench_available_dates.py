@@ -0,0 +1,103 @@
+"""
+get_available_dates：舊版（DISTINCT + 每個日期一次 is_open_date）vs 新版（LEFT JOIN 一條 SQL）
+
+先確認兩版在一年份資料、多種開課星期設定下結果完全相同（不同就 exit 1），再比速度
+
+    python -m bench.bench_available_dates --days 365
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import db
+
+WEEKDAY_RULES = [
+    frozenset({0, 1, 2, 3}),
+    frozenset({5, 6}),
+    frozenset(range(7)),
+    frozenset(),
+]
+
+
+def legacy_get_available_dates(open_weekdays):
+    cur = db.get_connection().cursor()
+    cur.execute("""
+        SELECT DISTINCT date
+        FROM slots
+        WHERE status = 'available'
+        ORDER BY date
+    """)
+
+    def is_open_date(date_str):
+        row = db.get_connection().execute(
+            "SELECT status FROM date_overrides WHERE date = ?", (date_str,)
+        ).fetchone()
+        if row:
+            return row[0] == "open"
+        return datetime.strptime(date_str, "%Y-%m-%d").weekday() in open_weekdays
+
+    return [d for (d,) in cur.fetchall() if is_open_date(d)]
+
+
+def seed(days):
+    rnd = random.Random(42)
+    start = date.today()
+    slots, overrides = [], []
+
+    for i in range(days):
+        d = (start + timedelta(days=i)).isoformat()
+        for h in (10, 11, 14, 15, 19):
+            status = rnd.choice(["available", "available", "booked", "blocked"])
+            slots.append((f"{d}T{h}:00", d, f"{h}:00", f"{h + 1}:00", status, None))
+        if rnd.random() < 0.1:
+            overrides.append((d, rnd.choice(["open", "closed"])))
+
+    with db.transaction() as cur:
+        cur.executemany("INSERT INTO slots (id, date, start_time, end_time, status, user_id) VALUES (?, ?, ?, ?, ?, ?)", slots)
+        cur.executemany("INSERT INTO date_overrides (date, status) VALUES (?, ?)", overrides)
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "dates.db")
+        # 量的是 SQL 本身，不要讓可預約快取擋在前面
+        os.environ["AVAILABILITY_CACHE"] = "0"
+        db.init_db()
+        seed(args.days)
+
+        for rule in WEEKDAY_RULES:
+            old = legacy_get_available_dates(rule)
+            new = db.get_available_dates(rule)
+            if old != new:
+                print(f"MISMATCH open_weekdays={sorted(rule)}: {len(old)} vs {len(new)} dates")
+                sys.exit(1)
+        print(f"equivalent for {len(WEEKDAY_RULES)} weekday rules")
+
+        before = best_of(lambda: legacy_get_available_dates(db.OPEN_WEEKDAYS), args.repeat)
+        after = best_of(lambda: db.get_available_dates(), args.repeat)
+        db.close_connections()
+
+    print(f"before (N+1)     : {before * 1000:8.2f} ms")
+    print(f"after  (one SQL) : {after * 1000:8.2f} ms  x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
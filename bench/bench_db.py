@@ -0,0 +1,129 @@
+"""
+連線池 benchmark：每次呼叫都 connect/close（舊做法） vs db.py 的 thread 長連線 + WAL
+
+    python -m bench.bench_db --threads 4 --ops 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import db
+
+TIME_SLOTS = [("10:00", "11:00"), ("11:00", "12:00"), ("14:00", "15:00"),
+              ("15:00", "16:00"), ("19:00", "20:00")]
+
+
+def seed(path, days):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS slots (
+            id TEXT PRIMARY KEY, date TEXT, start_time TEXT,
+            end_time TEXT, status TEXT, user_id TEXT
+        )
+    """)
+    start = date.today()
+    rows = []
+    for i in range(days):
+        d = (start + timedelta(days=i)).isoformat()
+        for s, e in TIME_SLOTS:
+            rows.append((f"{d}T{s}", d, s, e, "available", None))
+    conn.executemany("INSERT INTO slots (id, date, start_time, end_time, status, user_id) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return [r[1] for r in rows[::len(TIME_SLOTS)]]
+
+# ===== 舊做法：每次呼叫都開新連線 =====
+
+
+def legacy_slots_by_date(path, d):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("""
+        SELECT date, start_time, end_time FROM slots
+        WHERE date = ? AND status = 'available' ORDER BY start_time
+    """, (d,)).fetchall()
+    conn.close()
+    return rows
+
+
+def legacy_book_and_cancel(path, d, start, end, user_id):
+    for sql, args in (
+        ("UPDATE slots SET status = 'booked', user_id = ? WHERE date = ? "
+         "AND start_time = ? AND end_time = ? AND status = 'available'",
+         (user_id, d, start, end)),
+        ("UPDATE slots SET status = 'available', user_id = NULL WHERE date = ? "
+         "AND start_time = ? AND end_time = ? AND status = 'booked' AND user_id = ?",
+         (d, start, end, user_id)),
+    ):
+        conn = sqlite3.connect(path)
+        conn.execute(sql, args)
+        conn.commit()
+        conn.close()
+
+# ===== 新做法：db.py =====
+
+
+def pooled_slots_by_date(path, d):
+    return db.get_available_slots_by_date(d)
+
+
+def pooled_book_and_cancel(path, d, start, end, user_id):
+    db.book_slot(f"{d}T{start}-{end}", user_id)
+    db.cancel_slot_by_time(d, start, end, user_id)
+
+
+def run(path, dates, read_fn, write_fn, threads, ops, write_ratio):
+    def worker(n):
+        rnd = random.Random(n)
+        for _ in range(ops):
+            d = rnd.choice(dates)
+            if rnd.random() < write_ratio:
+                s, e = rnd.choice(TIME_SLOTS)
+                write_fn(path, d, s, e, f"U{n}")
+            else:
+                read_fn(path, d)
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return threads * ops / elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--ops", type=int, default=2000, help="每個 thread 的操作數")
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--write-ratio", type=float, default=0.1)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        dates = seed(legacy_path, args.days)
+        db.DB_NAME = pooled_path
+        # 量的是 SQL 本身，不要讓可預約快取擋在前面
+        os.environ["AVAILABILITY_CACHE"] = "0"
+        db.init_db()
+        seed(pooled_path, args.days)
+
+        before = run(legacy_path, dates, legacy_slots_by_date, legacy_book_and_cancel,
+                     args.threads, args.ops, args.write_ratio)
+        after = run(pooled_path, dates, pooled_slots_by_date, pooled_book_and_cancel,
+                    args.threads, args.ops, args.write_ratio)
+
+    print(f"threads={args.threads} ops/thread={args.ops} write_ratio={args.write_ratio}")
+    print(f"before (connect per call): {before:10.0f} ops/s")
+    print(f"after  (pooled + WAL)    : {after:10.0f} ops/s  x{after / before:.1f}")
+
+
+if __name__ == "__main__":
+    main()
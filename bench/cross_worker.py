@@ -0,0 +1,77 @@
+"""
+跨 process 快取一致性檢查：模擬兩個 gunicorn worker 共用同一個 booking.db
+
+worker A 先把可預約資料讀進自己的快取，worker B 訂走一個時段，
+A 馬上再讀一次，必須看不到那個時段（看得到就 exit 1）
+
+    python -m bench.cross_worker
+"""
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+
+import db
+
+DATE = "2030-01-07"
+SLOT_ID = f"{DATE}T10:00-11:00"
+
+
+def worker_a(path, ready, booked, result):
+    db.DB_NAME = path
+    before = db.get_available_slots_by_date(DATE)
+    db.get_available_slots_by_date(DATE)   # 第二次一定是快取命中
+    ready.set()
+
+    booked.wait()
+    after = db.get_available_slots_by_date(DATE)
+    result.put((before, after, db.availability_cache().stats()))
+
+
+def worker_b(path, ready, booked, result):
+    db.DB_NAME = path
+    ready.wait()
+    result.put(db.book_slot(SLOT_ID, "U_worker_b"))
+    booked.set()
+
+
+def main():
+    ctx = mp.get_context("spawn")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "workers.db")
+        db.DB_NAME = path
+        db.init_db()
+        with db.transaction() as cur:
+            cur.executemany(
+                "INSERT INTO slots (id, date, start_time, end_time, status) VALUES (?, ?, ?, ?, 'available')",
+                [(f"{DATE}T{h}:00", DATE, f"{h}:00", f"{h + 1}:00") for h in (10, 11, 14)],
+            )
+        db.close_connections()
+
+        ready, booked = ctx.Event(), ctx.Event()
+        result_a, result_b = ctx.Queue(), ctx.Queue()
+        procs = [
+            ctx.Process(target=worker_a, args=(path, ready, booked, result_a)),
+            ctx.Process(target=worker_b, args=(path, ready, booked, result_b)),
+        ]
+        for p in procs:
+            p.start()
+
+        ok_b = result_b.get(timeout=30)
+        before, after, stats = result_a.get(timeout=30)
+        for p in procs:
+            p.join()
+
+    print(f"worker B booked {SLOT_ID}: {ok_b}")
+    print(f"worker A before: {[s[1] for s in before]}")
+    print(f"worker A after : {[s[1] for s in after]}  cache={stats}")
+
+    if not ok_b or any(s[1] == "10:00" for s in after):
+        print("FAIL: worker A 讀到過期的可預約資料")
+        sys.exit(1)
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+webhook 解析 / 回覆 payload 組裝：SDK 路徑 vs 快速路徑
+
+    python -m bench.parse_payload --events 5 --iterations 2000
+
+parse：WebhookParser.parse（完整 linebot.models）vs line_events.parse_events（驗簽 + 一次 JSON 解碼）
+send ：FlexSendMessage + as_json_dict + json.dumps（httpx json=）vs flex_message dict + encode_body
+兩邊的結果會先比對一次，內容不同就 FAIL
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import time
+import uuid
+
+from linebot import WebhookParser
+from linebot.models import FlexSendMessage, TextSendMessage
+
+import fast_json
+from flex import build_date_carousel
+from flex_cancel_list import build_cancel_list_flex
+from flex_confirm import build_confirm_flex
+from flex_date_picker import build_date_picker
+from flex_day_slots import build_day_slots
+from line_client import encode_body, flex_message, text_message, to_payload
+from line_events import parse_events
+
+SECRET = "bench-channel-secret"
+
+
+def webhook_body(count):
+    events = []
+    for i in range(count):
+        event = {
+            "mode": "active",
+            "timestamp": 1700000000000 + i,
+            "source": {"type": "user", "userId": f"U{i:032x}"},
+            "replyToken": uuid.uuid4().hex,
+            "webhookEventId": uuid.uuid4().hex,
+            "deliveryContext": {"isRedelivery": False},
+        }
+        if i % 2:
+            event.update(type="postback", postback={"data": f"SLOT|2030-01-07T{10 + i % 8:02}:00-{11 + i % 8:02}:00"})
+        else:
+            event.update(type="message", message={"type": "text", "id": str(i), "text": "預約"})
+        events.append(event)
+
+    body = json.dumps({"destination": "Ubench", "events": events}, ensure_ascii=False).encode("utf-8")
+    signature = base64.b64encode(hmac.new(SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return body, signature
+
+
+def sample_messages():
+    """(名稱, alt_text, Flex dict)：app 實際會回的幾種"""
+    dates = [f"2030-01-{d:02}" for d in range(1, 29)]
+    slots = [("2030-01-07", f"{h:02}:00", f"{h + 1:02}:00", 1, 1 if h % 3 else 6, 700 + h) for h in range(9, 21)]
+    booked = [("2030-01-07", f"{h:02}:00", f"{h + 1:02}:00", 700 + h) for h in range(9, 14)]
+    return [
+        ("date_picker", "請選擇日期", build_date_picker(dates)),
+        ("date_carousel", "請選擇日期", build_date_carousel(dates[:21], 2, dates[20])),
+        ("day_slots", "可預約時段", build_day_slots("2030-01-07", slots)),
+        ("confirm", "確認預約", build_confirm_flex(710, "2030-01-07", "10:00", "11:00")),
+        ("cancel_list", "取消預約", build_cancel_list_flex(booked)),
+    ]
+
+
+def per_call(fn, iterations):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / iterations
+
+
+def check_parse(body, signature):
+    sdk = WebhookParser(SECRET).parse(body.decode("utf-8"), signature)
+    fast = parse_events(body, signature, SECRET.encode())
+    for a, b in zip(sdk, fast):
+        expected = (
+            a.type, a.webhook_event_id, a.reply_token, a.source.user_id,
+            getattr(getattr(a, "message", None), "text", None),
+            getattr(getattr(a, "postback", None), "data", None),
+        )
+        got = (b.type, b.webhook_event_id, b.reply_token, b.user_id, b.text, b.data)
+        if expected != got:
+            return f"{expected} != {got}"
+    return None if len(sdk) == len(fast) else "事件數不同"
+
+
+def sdk_body(alt_text, contents):
+    return json.dumps({
+        "replyToken": "r",
+        "messages": to_payload([FlexSendMessage(alt_text=alt_text, contents=contents), TextSendMessage(text="ok")]),
+    }).encode("utf-8")
+
+
+def fast_body(alt_text, contents):
+    return encode_body({"replyToken": "r"}, [flex_message(alt_text, contents), text_message("ok")])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--events", type=int, default=5, help="每個 webhook body 的事件數")
+    ap.add_argument("--iterations", type=int, default=2000)
+    args = ap.parse_args()
+
+    failures = 0
+    print(f"json: {'orjson' if fast_json.orjson else 'stdlib json'}")
+
+    body, signature = webhook_body(args.events)
+    error = check_parse(body, signature)
+    if error:
+        print(f"FAIL parse: {error}")
+        failures += 1
+
+    parser = WebhookParser(SECRET)
+    secret = SECRET.encode()
+    sdk = per_call(lambda: parser.parse(body.decode("utf-8"), signature), args.iterations)
+    fast = per_call(lambda: parse_events(body, signature, secret), args.iterations)
+    print(f"{'parse':<20}{args.events:>3} events  sdk {sdk * 1e6:8.1f} us  fast {fast * 1e6:8.1f} us  x{sdk / fast:.1f}")
+
+    for name, alt_text, contents in sample_messages():
+        if json.loads(sdk_body(alt_text, contents)) != fast_json.loads(fast_body(alt_text, contents)):
+            print(f"FAIL {name}: 序列化結果不同")
+            failures += 1
+        sdk = per_call(lambda: sdk_body(alt_text, contents), args.iterations)
+        fast = per_call(lambda: fast_body(alt_text, contents), args.iterations)
+        size = len(fast_body(alt_text, contents))
+        print(f"{'send ' + name:<20}{size:>7} B  sdk {sdk * 1e6:8.1f} us  fast {fast * 1e6:8.1f} us  x{sdk / fast:.1f}")
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+推播吞吐量 / 重試行為：outbox 塞 N 則 push，用 drain 送到本機 stub（line_stub.py），
+stub 可以注入延遲、429、5xx
+
+    python -m bench.push_stub --messages 500 --rate-429 0.1 --rate-5xx 0.05 --latency-ms 20
+
+--distinct 讓每個人內容都不同（不會合併成 multicast），量一對一 push 的上限
+送完檢查 outbox：sent + dead 要等於 N，而且 stub 收到的人數不能超過 N（retry key 去重）
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import db
+from line_client import LineClient
+from line_stub import StubServer, add_fault_arguments, fault_options
+import outbox
+
+
+def seed(count, distinct):
+    with db.transaction() as cur:
+        for i in range(count):
+            text = f"提醒 #{i}" if distinct else "明天有課喔"
+            db.enqueue_outbox(cur, f"U{i:05}", {"type": "text", "text": text}, dedupe_key=f"bench:{i}")
+
+
+async def drain_all(client, deadline):
+    """drain 到 outbox 清空（要重試的會排 backoff，等它們到期再送）"""
+    total = {"sent": 0, "failed": 0, "retried": 0, "requests": 0}
+    while time.perf_counter() < deadline:
+        stats = await outbox.drain(client)
+        for key in total:
+            total[key] += stats[key]
+
+        pending = db.get_connection().execute(
+            "SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending')"
+        ).fetchone()[0]
+        if not pending:
+            break
+        await asyncio.sleep(0.05)
+    return total
+
+
+async def run(args):
+    stub = StubServer(**fault_options(args))
+    client = LineClient("bench-token", base_url=stub.start(), max_retries=args.max_retries, backoff=0.05)
+
+    seed(args.messages, args.distinct)
+    t0 = time.perf_counter()
+    try:
+        total = await drain_all(client, t0 + args.timeout)
+    finally:
+        await client.aclose()
+    elapsed = time.perf_counter() - t0
+    stub.stop()
+
+    rows = dict(db.get_connection().execute(
+        "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+    ).fetchall())
+    return total, elapsed, rows, stub.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=500)
+    ap.add_argument("--distinct", action="store_true", help="每則內容不同，不合併成 multicast")
+    ap.add_argument("--max-retries", type=int, default=3, help="LineClient 單次呼叫的重試次數")
+    ap.add_argument("--timeout", type=float, default=60)
+    add_fault_arguments(ap)
+    args = ap.parse_args()
+
+    # outbox 的 backoff 縮短，不然 5xx 之後要等好幾秒
+    os.environ["OUTBOX_BACKOFF"] = "0.05"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "push.db")
+        db.init_db()
+        total, elapsed, rows, stub_stats = asyncio.run(run(args))
+        db.close_connections()
+
+    print(f"{args.messages} messages in {elapsed:.2f} s = {args.messages / elapsed:.0f} msg/s")
+    print(f"drain : {total}")
+    print(f"outbox: {rows}")
+    print(f"stub  : {stub_stats}")
+
+    done = rows.get("sent", 0) + rows.get("dead", 0)
+    if done != args.messages or stub_stats["recipients"] > args.messages:
+        print("FAIL: outbox 沒送完，或同一則送了兩次")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
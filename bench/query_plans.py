@@ -0,0 +1,105 @@
+"""
+檢查熱門查詢的 query plan：任何一條退化成 SCAN（全表掃描）就 exit 1
+
+實際呼叫 db.py 的函式並用 trace callback 收集送出的 SQL，
+所以改了查詢不用同步改這裡。
+
+    python -m bench.query_plans
+"""
+import os
+import sys
+import tempfile
+
+import db
+
+# 測試資料的 slots.id -> sid，main() 填（sid 由 DB 配）
+SIDS = {}
+
+
+def sid(slot_id):
+    return SIDS[slot_id]
+
+
+HOT_CALLS = [
+    ("get_available_dates", lambda: db.get_available_dates()),
+    ("get_available_dates_page", lambda: db.get_available_dates_page(after="2030-01-14", limit=7)),
+    ("get_available_slots_by_date", lambda: db.get_available_slots_by_date("2030-01-07")),
+    ("get_available_slots_for_dates", lambda: db.get_available_slots_for_dates(["2030-01-07", "2030-01-08"])),
+    ("get_all_slots_by_date", lambda: db.get_all_slots_by_date("2030-01-07")),
+    ("get_user_booked_slots", lambda: db.get_user_booked_slots("U0")),
+    ("get_user_booked_slots_for_users", lambda: db.get_user_booked_slots_for_users(["U0", "U1"])),
+    ("get_tomorrow_bookings", lambda: db.get_tomorrow_bookings()),
+    ("is_open_date", lambda: db.is_open_date("2030-01-07")),
+    ("get_open_status_for_range", lambda: db.get_open_status_for_range(3)),
+    ("get_slot", lambda: db.get_slot(sid("2030-01-07T10:00"))),
+    ("get_slot (legacy)", lambda: db.get_slot("2030-01-07T10:00-11:00")),
+    ("hold_slot", lambda: db.hold_slot(sid("2030-01-07T11:00"), "U0", ttl=0)),
+    ("sweep_expired_holds", lambda: db.sweep_expired_holds()),
+    ("release_hold", lambda: db.hold_slot(sid("2030-01-07T11:00"), "U1") and db.release_hold("U1")),
+    ("claim_webhook_events", lambda: db.claim_webhook_events(["E0"])),
+    ("prune_webhook_events", lambda: db.prune_webhook_events(0)),
+    ("book_slot", lambda: db.book_slot(sid("2030-01-07T10:00"), "U0")),
+    ("cancel_booking", lambda: db.cancel_booking(sid("2030-01-07T10:00"), "U0")),
+    ("book_slot (legacy)", lambda: db.book_slot("2030-01-07T10:00-11:00", "U0")),
+    ("cancel_slot_by_time", lambda: db.cancel_slot_by_time("2030-01-07", "10:00", "11:00", "U0")),
+]
+
+
+def collect_statements(conn, fn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+
+    keywords = ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")
+    return [s for s in statements if s.lstrip().upper().startswith(keywords)]
+
+
+def main():
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "plans.db")
+        # 每次都要真的下 SQL 才抓得到 query plan
+        os.environ["AVAILABILITY_CACHE"] = "0"
+        db.init_db()
+        conn = db.get_connection()
+        # 表裡要有資料 + ANALYZE，planner 才會照正式環境的方式選索引
+        with conn:
+            conn.executemany(
+                "INSERT INTO slots (id, date, start_time, end_time, status) VALUES (?, ?, ?, ?, 'available')",
+                [(f"2030-01-{d:02}T{h}:00", f"2030-01-{d:02}", f"{h}:00", f"{h + 1}:00")
+                 for d in range(1, 29) for h in range(10, 20)],
+            )
+            SIDS.update(conn.execute("SELECT id, sid FROM slots").fetchall())
+            conn.executemany(
+                "INSERT INTO bookings (tenant, slot_id, user_id) VALUES ('default', ?, ?)",
+                [(SIDS[f"2030-01-{d:02}T{h}:00"], f"U{d % 7}")
+                 for d in range(1, 29) for h in range(10, 20, 3)],
+            )
+        conn.execute("ANALYZE")
+
+        seen = set()
+        for name, fn in HOT_CALLS:
+            for sql in collect_statements(conn, fn):
+                plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+                if (name, tuple(plan)) in seen:
+                    continue
+                seen.add((name, tuple(plan)))
+
+                scans = [p for p in plan if p.startswith("SCAN")]
+                mark = "FAIL" if scans else "ok  "
+                failures += bool(scans)
+                print(f"{mark} {name}: {' / '.join(plan)}")
+
+        db.close_connections()
+
+    if failures:
+        print(f"{failures} 條查詢沒有用到索引")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+搶名額壓力測試：很多 thread 同時搶同一堂課的最後幾個名額，不能超賣
+
+1. 搶位：每一輪開一堂 capacity 人的課，threads 個學員同時搶，
+   一半直接 book_slot、一半先 hold_slot 再確認（SLOT| → CONFIRM|），
+   成功人數必須剛好是 capacity
+2. 吞吐量：threads 個 thread 在 slots 堂課之間隨機訂 / 取消
+
+最後檢查每堂課 booked == bookings + holds 筆數 <= capacity，有任何一筆不對就 exit 1
+
+    python -m bench.stress_booking --threads 32 --capacity 5
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import db
+
+DATE = "2030-01-07"
+
+
+def slot_times(i):
+    minutes = 8 * 60 + i * 15
+    start = f"{minutes // 60:02}:{minutes % 60:02}"
+    end = f"{(minutes + 15) // 60:02}:{(minutes + 15) % 60:02}"
+    return start, end
+
+
+def add_slots(count, capacity):
+    rows = []
+    for i in range(count):
+        start, end = slot_times(i)
+        rows.append((f"{DATE}T{start}", DATE, start, end, capacity))
+    with db.transaction() as cur:
+        cur.execute("DELETE FROM bookings")
+        cur.execute("DELETE FROM holds")
+        cur.execute("DELETE FROM slots")
+        cur.executemany("""
+            INSERT INTO slots (id, date, start_time, end_time, status, capacity)
+            VALUES (?, ?, ?, ?, 'available', ?)
+        """, rows)
+        cur.execute("SELECT sid FROM slots ORDER BY sid")
+        return [sid for (sid,) in cur.fetchall()]
+
+
+def run_threads(threads, target):
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def wrapper(n):
+        barrier.wait()
+        try:
+            target(n)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close_connections()
+
+    pool = [threading.Thread(target=wrapper, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - t0, errors
+
+
+def check_invariants():
+    """回傳不一致的時段：booked 和 bookings + holds 筆數不同，或超過 capacity"""
+    conn = db.get_connection()
+    return conn.execute("""
+        SELECT s.id, s.capacity, s.booked, s.status,
+               (SELECT COUNT(*) FROM bookings b WHERE b.tenant = s.tenant AND b.slot_id = s.sid)
+             + (SELECT COUNT(*) FROM holds h WHERE h.tenant = s.tenant AND h.slot_id = s.sid) AS taken
+        FROM slots s
+        WHERE s.booked != taken
+           OR s.booked > s.capacity
+           OR (s.status = 'booked') != (s.booked >= s.capacity)
+    """).fetchall()
+
+
+def last_seat_race(threads, capacity, rounds):
+    failures = 0
+
+    for r in range(rounds):
+        (slot_id,) = add_slots(1, capacity)
+        results = [None] * threads
+
+        def book(n):
+            user_id = f"U{r}_{n}"
+            if n % 2 and not db.hold_slot(slot_id, user_id):
+                results[n] = False
+                return
+            results[n] = db.book_slot(slot_id, user_id)
+
+        _, errors = run_threads(threads, book)
+        won = sum(1 for ok in results if ok)
+        bad = check_invariants()
+        if errors or won != min(capacity, threads) or bad:
+            failures += 1
+            print(f"FAIL round {r}: won={won} errors={errors[:3]} bad={bad}")
+
+    print(f"last-seat race: {rounds} rounds x {threads} threads, capacity={capacity}, failures={failures}")
+    return failures
+
+
+def throughput(threads, slots, capacity, ops):
+    slot_ids = add_slots(slots, capacity)
+    counts = {"booked": 0, "rejected": 0, "cancelled": 0}
+    lock = threading.Lock()
+
+    def worker(n):
+        rnd = random.Random(n)
+        mine = []
+        local = {"booked": 0, "rejected": 0, "cancelled": 0}
+        for _ in range(ops):
+            if mine and rnd.random() < 0.3:
+                slot_id = mine.pop(rnd.randrange(len(mine)))
+                if db.cancel_booking(slot_id, f"U{n}"):
+                    local["cancelled"] += 1
+                continue
+
+            slot_id = rnd.choice(slot_ids)
+            if slot_id not in mine and db.book_slot(slot_id, f"U{n}"):
+                mine.append(slot_id)
+                local["booked"] += 1
+            else:
+                local["rejected"] += 1
+
+        with lock:
+            for key in counts:
+                counts[key] += local[key]
+
+    elapsed, errors = run_threads(threads, worker)
+    bad = check_invariants()
+    total = threads * ops
+    print(
+        f"throughput: {total / elapsed:8.0f} ops/s  ({threads} threads, {slots} slots x {capacity} seats) "
+        f"booked={counts['booked']} rejected={counts['rejected']} cancelled={counts['cancelled']}"
+    )
+    if errors or bad:
+        print(f"FAIL errors={errors[:3]} bad={bad[:5]}")
+        return 1
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--capacity", type=int, default=5)
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--slots", type=int, default=20)
+    ap.add_argument("--ops", type=int, default=200, help="吞吐量測試每個 thread 的操作數")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_NAME = os.path.join(tmp, "stress.db")
+        db.init_db()
+
+        failures = last_seat_race(args.threads, 1, args.rounds)
+        failures += last_seat_race(args.threads, args.capacity, args.rounds)
+        failures += throughput(args.threads, args.slots, args.capacity, args.ops)
+        db.close_connections()
+
+    if failures:
+        sys.exit(1)
+    print("ok: no overbooking")
+
+
+if __name__ == "__main__":
+    main()
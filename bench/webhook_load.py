@@ -0,0 +1,367 @@
+"""
+webhook 壓測：簽好名的 webhook 打進 app:app，LINE API 指到本機 stub（line_stub.py）
+
+每個虛擬學員照 bot 實際回的按鈕走完整流程
+預約 → DATE| → SLOT| → CONFIRM| → 取消 → CANCEL_PREVIEW| → CANCEL_CONFIRM|，
+latency 從送出 webhook 算到 stub 收到 reply 為止（背景 worker 模式也準），
+統計各 handler 的 p50 / p95 / p99 與 events/s，結果存成 JSON 給之後的 commit 比對
+
+    python -m bench.webhook_load --users 50 --rounds 5 --out before.json
+    python -m bench.webhook_load --users 50 --rounds 5 --compare before.json
+    python -m bench.webhook_load --replay captured.jsonl   # 錄下來的 webhook body，每行一個
+
+預設在同一個 process 裡用 ASGI 直接打 app（temp DB，不碰 booking.db）；
+--url 改打已經在跑的 server，該 server 要設 LINE_API_BASE_URL=http://127.0.0.1:<--stub-port>
+和相同的 LINE_CHANNEL_SECRET
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+
+from line_stub import StubServer, add_fault_arguments, fault_options
+
+SECRET = "bench-channel-secret"
+REPLY_TIMEOUT = 10
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = 0
+        self.skipped = 0
+
+    def add(self, label, seconds):
+        self.latencies.setdefault(label, []).append(seconds)
+
+    def summary(self, elapsed):
+        handlers = {}
+        for label, values in sorted(self.latencies.items()):
+            values.sort()
+            handlers[label] = {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "events_per_sec": round(len(values) / elapsed, 1),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "events": total,
+            "seconds": round(elapsed, 3),
+            "events_per_sec": round(total / elapsed, 1) if elapsed else 0,
+            "errors": self.errors,
+            "handlers": handlers,
+        }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+# ===== webhook body =====
+
+
+def sign(body, secret):
+    digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def base_event(user_id):
+    return {
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "replyToken": uuid.uuid4().hex,
+        "webhookEventId": uuid.uuid4().hex,
+        "deliveryContext": {"isRedelivery": False},
+    }
+
+
+def text_event(user_id, text):
+    event = base_event(user_id)
+    event.update(type="message", message={"type": "text", "id": uuid.uuid4().hex[:16], "text": text})
+    return event
+
+
+def postback_event(user_id, data):
+    event = base_event(user_id)
+    event.update(type="postback", postback={"data": data})
+    return event
+
+
+def label_of(event):
+    if event.get("type") == "postback":
+        return event["postback"]["data"].split("|", 1)[0]
+    if event.get("type") == "message":
+        return event["message"].get("text", "message")
+    return event.get("type", "unknown")
+
+
+def postback_data(messages, prefix):
+    """reply 內容裡所有 prefix 開頭的 postback data"""
+    found = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            data = node.get("data")
+            if isinstance(data, str) and data.startswith(prefix):
+                found.append(data)
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(messages or [])
+    return found
+
+# ===== 送出 =====
+
+
+class Driver:
+    def __init__(self, client, stub, recorder, secret, path):
+        self.client = client
+        self.stub = stub
+        self.recorder = recorder
+        self.secret = secret
+        self.path = path
+
+    async def send(self, event):
+        """送一個事件，回傳 bot 的 reply messages（沒有回覆或失敗回傳 None）"""
+        body = json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False)
+        return await self.post(body, [event])
+
+    async def post(self, body, events):
+        t0 = time.perf_counter()
+        try:
+            resp = await self.client.post(
+                self.path,
+                content=body.encode(),
+                headers={"x-line-signature": sign(body, self.secret), "content-type": "application/json"},
+            )
+        except httpx.HTTPError:
+            self.recorder.errors += 1
+            return None
+        responded = time.perf_counter()
+        if resp.status_code != 200:
+            self.recorder.errors += 1
+            return None
+
+        messages = None
+        for event in events:
+            reply = await self.wait_reply(event.get("replyToken"))
+            if reply is None:
+                self.recorder.add(label_of(event), responded - t0)
+                continue
+            received, messages = reply
+            self.recorder.add(label_of(event), received - t0)
+        return messages
+
+    async def wait_reply(self, reply_token):
+        if not reply_token:
+            return None
+        deadline = time.perf_counter() + REPLY_TIMEOUT
+        while time.perf_counter() < deadline:
+            reply = self.stub.pop_reply(reply_token)
+            if reply is not None:
+                return reply
+            await asyncio.sleep(0.001)
+        return None
+
+
+async def user_flow(driver, user_id, rounds, rnd):
+    for _ in range(rounds):
+        dates = postback_data(await driver.send(text_event(user_id, "預約")), "DATE|")
+        if not dates:
+            driver.recorder.skipped += 1
+            continue
+
+        slots = postback_data(await driver.send(postback_event(user_id, rnd.choice(dates))), "SLOT|")
+        if not slots:
+            driver.recorder.skipped += 1
+            continue
+
+        confirm = postback_data(await driver.send(postback_event(user_id, rnd.choice(slots))), "CONFIRM|")
+        if not confirm:
+            driver.recorder.skipped += 1   # 被別人暫留 / 訂走
+            continue
+        await driver.send(postback_event(user_id, confirm[0]))
+
+        previews = postback_data(await driver.send(text_event(user_id, "取消")), "CANCEL_PREVIEW|")
+        if not previews:
+            continue
+        cancels = postback_data(await driver.send(postback_event(user_id, previews[0])), "CANCEL_CONFIRM|")
+        if cancels:
+            await driver.send(postback_event(user_id, cancels[0]))
+
+
+async def replay(driver, path, concurrency):
+    bodies = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                body = json.loads(line)
+            except ValueError:
+                body = None
+            if not isinstance(body, dict) or not isinstance(body.get("events"), list):
+                driver.recorder.skipped += 1
+                continue
+            bodies.append(body)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(body):
+        # 換掉 replyToken / webhookEventId，重播時不會被去重擋掉
+        for event in body["events"]:
+            if "replyToken" in event:
+                event["replyToken"] = uuid.uuid4().hex
+            event["webhookEventId"] = uuid.uuid4().hex
+        async with semaphore:
+            await driver.post(json.dumps(body, ensure_ascii=False), body["events"])
+
+    await asyncio.gather(*(send(b) for b in bodies))
+    return len(bodies)
+
+# ===== app =====
+
+
+@asynccontextmanager
+async def in_process_app(args, stub_url, tmp):
+    """temp DB + stub，在同一個 process 裡起 app（要在 import app 之前設好環境變數）"""
+    os.environ.update({
+        "TENANTS": "default",
+        "LINE_CHANNEL_SECRET": args.secret,
+        "LINE_CHANNEL_ACCESS_TOKEN": "bench-token",
+        "LINE_API_BASE_URL": stub_url,
+        "SLOT_ROLLING_WEEKS": str(args.weeks),
+        "WEBHOOK_ASYNC": "1" if args.async_webhook else "0",
+    })
+    import db
+    db.DB_NAME = os.path.join(tmp, "bench.db")
+    import app as appmod
+
+    async with appmod.app.router.lifespan_context(appmod.app):
+        transport = httpx.ASGITransport(app=appmod.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            yield client
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(result, baseline=None):
+    base = (baseline or {}).get("handlers", {})
+    print(f"{'handler':<16}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ev/s':>9}")
+    for label, h in result["handlers"].items():
+        line = (f"{label:<16}{h['count']:>7}{h['p50_ms']:>9.2f}{h['p95_ms']:>9.2f}"
+                f"{h['p99_ms']:>9.2f}{h['events_per_sec']:>9.1f}")
+        old = base.get(label)
+        if old and old["p95_ms"]:
+            line += f"   p95 {(h['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}% vs {baseline.get('commit')}"
+        print(line)
+    print(f"total: {result['events']} events in {result['seconds']} s = "
+          f"{result['events_per_sec']} events/s, errors={result['errors']}, skipped={result['skipped']}")
+
+
+async def run(args):
+    stub = StubServer(port=args.stub_port, **fault_options(args))
+    stub_url = stub.start()
+    recorder = Recorder()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            client_cm = httpx.AsyncClient(base_url=args.url, timeout=REPLY_TIMEOUT)
+        else:
+            client_cm = in_process_app(args, stub_url, tmp)
+
+        async with client_cm as client:
+            driver = Driver(client, stub, recorder, args.secret, args.path)
+            t0 = time.perf_counter()
+            if args.replay:
+                await replay(driver, args.replay, args.users)
+            else:
+                await asyncio.gather(*(
+                    user_flow(driver, f"Ubench{n:05}", args.rounds, random.Random(n))
+                    for n in range(args.users)
+                ))
+            elapsed = time.perf_counter() - t0
+
+    stub.stop()
+
+    result = recorder.summary(elapsed)
+    result.update(
+        commit=git_commit(),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        skipped=recorder.skipped,
+        stub=stub.stats(),
+        config={
+            "users": args.users,
+            "rounds": args.rounds,
+            "replay": args.replay,
+            "url": args.url,
+            "async_webhook": args.async_webhook,
+            "stub": fault_options(args),
+        },
+    )
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="webhook 壓測")
+    ap.add_argument("--users", type=int, default=20, help="同時在跑的虛擬學員數（replay 時是併發數）")
+    ap.add_argument("--rounds", type=int, default=3, help="每個學員跑幾輪完整流程")
+    ap.add_argument("--weeks", type=int, default=4, help="in-process 模式先產生幾週的時段")
+    ap.add_argument("--replay", help="錄下來的 webhook body（JSONL），不是 webhook 的行會略過")
+    ap.add_argument("--url", help="改打已經在跑的 server，例如 http://127.0.0.1:8000")
+    ap.add_argument("--path", default="/webhook")
+    ap.add_argument("--secret", default=SECRET, help="簽名用的 channel secret")
+    ap.add_argument("--stub-port", type=int, default=0, help="stub 的 port（--url 模式要固定）")
+    ap.add_argument("--async-webhook", action="store_true", help="in-process 模式開 WEBHOOK_ASYNC=1")
+    add_fault_arguments(ap)
+    ap.add_argument("--out", help="結果存成 JSON")
+    ap.add_argument("--compare", help="和之前存的 JSON 比 p95")
+    args = ap.parse_args()
+
+    if args.url and not args.stub_port:
+        ap.error("--url 需要 --stub-port，並讓 server 的 LINE_API_BASE_URL 指到它")
+
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_summary(result, baseline)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"saved {args.out}")
+
+    if result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,8 @@
-from datetime import datetime
-from linebot.models import FlexSendMessage
+from date_labels import display_date
+from line_client import flex_message
 
 
 def build_coach_schedule_flex(date_str, rows):
-    dt = datetime.strptime(date_str, "%Y-%m-%d")
-    weekday = ["一", "二", "三", "四", "五", "六", "日"][dt.weekday()]
-    display_date = f"{dt.month}/{dt.day}（週{weekday}）"
-
     contents = [
         {
             "type": "text",
@@ -16,7 +12,7 @@ def build_coach_schedule_flex(date_str, rows):
         },
         {
             "type": "text",
-            "text": f"📅 {display_date}",
+            "text": f"📅 {display_date(date_str)}",
             "size": "sm",
             "color": "#666666"
         }
@@ -44,9 +40,9 @@ def build_coach_schedule_flex(date_str, rows):
             "margin": "md"
         })
 
-    return FlexSendMessage(
-        alt_text="明天課表提醒",
-        contents={
+    return flex_message(
+        "明天課表提醒",
+        {
             "type": "bubble",
             "body": {
                 "type": "box",
@@ -1,34 +1,51 @@
-import os
+import asyncio
 from dotenv import load_dotenv
-from linebot import LineBotApi
 
-from db import get_tomorrow_bookings, get_tomorrow_schedule_for_coach
-from reminder import send_reminder
-from coach_reminder import build_coach_schedule_message
+from db import init_db, transaction, enqueue_outbox, get_tomorrow_bookings, get_tomorrow_schedule_for_coach
+from outbox import drain
+from reminder import enqueue_reminders
+from coach_reminder import build_coach_schedule_flex
+from tenants import load_tenants
 
 load_dotenv()
 
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
 
-# 你的教練 LINE user_id（你已經有）
-COACH_IDS = {
-    "U17fdee62c51888ebea77d8b696eb38e4",
-}
+async def remind_tenant(tenant):
+    init_db(tenant.key)
 
-
-def main():
     # ===== 學員提醒 =====
-    bookings = get_tomorrow_bookings()
-    if bookings:
-        send_reminder(line_bot_api, bookings)
+    enqueue_reminders(get_tomorrow_bookings(tenant.key), tenant.key)
 
     # ===== 教練課表 =====
-    date_str, rows = get_tomorrow_schedule_for_coach()
+    date_str, rows = get_tomorrow_schedule_for_coach(tenant.key)
     coach_flex = build_coach_schedule_flex(date_str, rows)
 
-    for coach_id in COACH_IDS:
-        line_bot_api.push_message(coach_id, coach_msg)
+    with transaction(tenant.key) as cur:
+        for coach_id in tenant.coach_ids:
+            enqueue_outbox(
+                cur, coach_id, coach_flex,
+                dedupe_key=f"coach_schedule:{coach_id}:{date_str}",
+                tenant=tenant.key,
+            )
+
+    # ===== 送出（失敗的留在 outbox，由 app 的 drainer 之後重試）=====
+    return await drain(tenant.line_client, tenant.key)
+
+
+async def main():
+    tenants = load_tenants()
+
+    try:
+        for tenant in tenants.values():
+            stats = await remind_tenant(tenant)
+            print(
+                f"[{tenant.key}] 推播：sent={stats['sent']} failed={stats['failed']} "
+                f"retried={stats['retried']} requests={stats['requests']}"
+            )
+    finally:
+        for tenant in tenants.values():
+            await tenant.line_client.aclose()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+"""
+日期顯示用的小工具（Flex、提醒、教練課表共用）
+
+同一個日期字串只解析一次（lru_cache），不用每次 strptime
+"""
+from datetime import date
+from functools import lru_cache
+
+WEEKDAY_NAMES = "一二三四五六日"
+
+
+@lru_cache(maxsize=4096)
+def parse_date(date_str):
+    """YYYY-MM-DD → date"""
+    return date.fromisoformat(date_str)
+
+
+def weekday_name(date_str):
+    """一～日"""
+    return WEEKDAY_NAMES[parse_date(date_str).weekday()]
+
+
+def display_date(date_str):
+    """1/7（週二）"""
+    d = parse_date(date_str)
+    return f"{d.month}/{d.day}（週{WEEKDAY_NAMES[d.weekday()]}）"
+
+
+def relative_tag(date_str, today):
+    """今天 / 明天的提示，其他日期是空字串"""
+    delta = (parse_date(date_str) - today).days
+    if delta == 0:
+        return "（今天）"
+    if delta == 1:
+        return "（明天）"
+    return ""
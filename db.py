@@ -1,212 +1,1181 @@
+import bisect
+import json
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import date, timedelta, datetime
 
+from availability_cache import AvailabilityCache
+from line_client import to_payload
+from metrics import histogram, timed
+from tracing import traced
+
 DB_NAME = "booking.db"
 
-# ================= 基本 =================
+# 預設的教練 / 場館；單一教練部署全部都用它
+DEFAULT_TENANT = "default"
 
+# DB_PER_TENANT=1：每個 tenant 各用一個 SQLite 檔（booking_<tenant>.db），寫入鎖互不影響
+# 預設所有 tenant 共用 DB_NAME，以 tenant 欄位區分
+# 在 db_path() 裡才讀：entry point 的 load_dotenv() 在 import db 之後才跑，import 時讀不到 .env
 
-def get_connection():
-    return sqlite3.connect(DB_NAME)
+# DB_BUSY_TIMEOUT_MS：等寫鎖的上限（預設 5000），開連線時才讀，理由同 DB_PER_TENANT
+STATEMENT_CACHE_SIZE = 256
 
+# 可預約資料快取（每個 tenant 一份）；所有會改變可預約狀態的寫入都要 invalidate
+# AVAILABILITY_CACHE=0 關掉，AVAILABILITY_CACHE_DATES 是每份快取的日期數上限（預設 512）
+# 建立快取時才讀，理由同 DB_PER_TENANT
+_caches = {}
 
-def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
+# HOLD_TTL：選時段後暫留名額的秒數（確認前別人訂不到），預設 300
+# 在 hold_slot() 裡才讀，理由同 DB_PER_TENANT
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS slots (
-        id TEXT PRIMARY KEY,
-        date TEXT,
-        start_time TEXT,
-        end_time TEXT,
-        status TEXT,
-        user_id TEXT
+DB_SECONDS = histogram("bot_db_seconds", "db.py 函式的執行時間", ["function"])
+
+# 沒有 override 時的預設開課日（date.weekday()，週一 = 0）
+OPEN_WEEKDAYS = frozenset({0, 1, 2, 3})   # 週一～週四開
+
+# ================= 連線池 =================
+
+# 每個 thread 各自持有長連線（sqlite3 連線不能跨 thread 共用）
+# 記下 pid，gunicorn fork 出來的 worker 不會沿用 master 的連線
+_local = threading.local()
+
+
+def _connect(path):
+    busy_timeout_ms = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+    conn = sqlite3.connect(
+        path,
+        timeout=busy_timeout_ms / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
     )
-    """)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout_ms}")
+    return conn
 
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS date_overrides (
-        date TEXT PRIMARY KEY,
-        status TEXT NOT NULL CHECK (status IN ('open', 'closed')),
-        reason TEXT,
-        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+
+def db_path(tenant=DEFAULT_TENANT):
+    """tenant 的 SQLite 檔；共用模式下全部都是 DB_NAME"""
+    if tenant == DEFAULT_TENANT or os.getenv("DB_PER_TENANT", "0") != "1":
+        return DB_NAME
+    stem, ext = os.path.splitext(DB_NAME)
+    return f"{stem}_{tenant}{ext}"
+
+
+def get_connection(tenant=DEFAULT_TENANT):
+    """
+    取得目前 thread 對 tenant 所在 DB 檔的長連線（第一次呼叫時建立）
+    呼叫端不要 close
+    """
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        _local.pid = pid
+        _local.conns = {}
+        _local.data_versions = {}
+
+    path = db_path(tenant)
+    conn = _local.conns.get(path)
+    if conn is None:
+        conn = _local.conns[path] = _connect(path)
+    return conn
+
+
+def close_connections():
+    """關閉目前 thread 持有的連線"""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+@contextmanager
+def transaction(tenant=DEFAULT_TENANT, immediate=False):
+    """
+    寫入用：正常結束 commit，發生例外 rollback
+    immediate=True 一開始就拿寫鎖；先讀再依結果寫的交易要用，
+    否則讀完才升級成寫鎖，遇到別人剛 commit 會直接 database is locked
+    """
+    conn = get_connection(tenant)
+    with conn:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn.cursor()
+
+
+def availability_cache(tenant=DEFAULT_TENANT):
+    """tenant 的可預約快取（第一次用到時建立）"""
+    cache = _caches.get(tenant)
+    if cache is None:
+        cache = _caches.setdefault(tenant, AvailabilityCache(
+            max_dates=int(os.getenv("AVAILABILITY_CACHE_DATES", "512")),
+            enabled=os.getenv("AVAILABILITY_CACHE", "1") == "1",
+        ))
+    return cache
+
+# ================= Migration =================
+
+# 每一版是一組 SQL，依序套用，套到第幾版記在 PRAGMA user_version
+# 只能往後加新版本，已上線的版本不要改
+MIGRATIONS = [
+    # v1：基本資料表
+    [
+        """
+        CREATE TABLE IF NOT EXISTS slots (
+            id TEXT PRIMARY KEY,
+            date TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            status TEXT,
+            user_id TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS date_overrides (
+            date TEXT PRIMARY KEY,
+            status TEXT NOT NULL CHECK (status IN ('open', 'closed')),
+            reason TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ],
+    # v2：slots 熱門查詢的複合索引
+    [
+        # get_available_dates：WHERE status = ? ORDER BY date
+        "CREATE INDEX IF NOT EXISTS idx_slots_status_date ON slots (status, date)",
+        # get_*_slots_by_date / book_slot / cancel_slot_by_time
+        "CREATE INDEX IF NOT EXISTS idx_slots_date_status_start ON slots (date, status, start_time)",
+        # get_user_booked_slots
+        "CREATE INDEX IF NOT EXISTS idx_slots_user_status_date ON slots (user_id, status, date, start_time)",
+    ],
+    # v3：可預約資料的 generation，給多個 worker 判斷自己的快取還能不能用
+    # slots / date_overrides 的任何寫入都由 trigger 把 gen + 1（手動改 DB 也算）
+    [
+        """
+        CREATE TABLE IF NOT EXISTS availability_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            gen INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO availability_generation (id, gen) VALUES (1, 0)",
+        *[
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_gen
+            AFTER {op} ON {table}
+            BEGIN
+                UPDATE availability_generation SET gen = gen + 1 WHERE id = 1;
+            END
+            """
+            for table in ("slots", "date_overrides")
+            for op in ("INSERT", "UPDATE", "DELETE")
+        ],
+    ],
+    # v4：outbox，待送的 push 訊息（和狀態變更同一個交易寫入，由 outbox.py 送出）
+    [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedupe_key TEXT UNIQUE,
+            recipient TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending'
+                CHECK (status IN ('pending', 'sending', 'sent', 'dead')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            sent_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)",
+    ],
+    # v5：多教練 / 多場館，所有資料加上 tenant
+    # slots / date_overrides 的主鍵要改成含 tenant，只能重建表
+    [
+        """
+        CREATE TABLE slots_v5 (
+            tenant TEXT NOT NULL DEFAULT 'default',
+            id TEXT NOT NULL,
+            date TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            status TEXT,
+            user_id TEXT,
+            PRIMARY KEY (tenant, id)
+        )
+        """,
+        """
+        INSERT INTO slots_v5 (tenant, id, date, start_time, end_time, status, user_id)
+        SELECT 'default', id, date, start_time, end_time, status, user_id FROM slots
+        """,
+        # 舊表的索引、trigger 會跟著 DROP
+        "DROP TABLE slots",
+        "ALTER TABLE slots_v5 RENAME TO slots",
+        """
+        CREATE TABLE date_overrides_v5 (
+            tenant TEXT NOT NULL DEFAULT 'default',
+            date TEXT NOT NULL,
+            status TEXT NOT NULL CHECK (status IN ('open', 'closed')),
+            reason TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tenant, date)
+        )
+        """,
+        """
+        INSERT INTO date_overrides_v5 (tenant, date, status, reason, updated_at)
+        SELECT 'default', date, status, reason, updated_at FROM date_overrides
+        """,
+        "DROP TABLE date_overrides",
+        "ALTER TABLE date_overrides_v5 RENAME TO date_overrides",
+        # 索引一律以 tenant 開頭
+        "CREATE INDEX idx_slots_tenant_status_date ON slots (tenant, status, date)",
+        "CREATE INDEX idx_slots_tenant_date_status_start ON slots (tenant, date, status, start_time)",
+        "CREATE INDEX idx_slots_tenant_user_status_date ON slots (tenant, user_id, status, date, start_time)",
+        # generation 改成每個 tenant 一筆，其他 tenant 的寫入不會讓自己的快取失效
+        "DROP TABLE availability_generation",
+        """
+        CREATE TABLE availability_generation (
+            tenant TEXT PRIMARY KEY,
+            gen INTEGER NOT NULL
+        )
+        """,
+        *[
+            f"""
+            CREATE TRIGGER trg_{table}_{op.lower()}_gen
+            AFTER {op} ON {table}
+            BEGIN
+                INSERT OR IGNORE INTO availability_generation (tenant, gen) VALUES ({row}.tenant, 0);
+                UPDATE availability_generation SET gen = gen + 1 WHERE tenant = {row}.tenant;
+            END
+            """
+            for table in ("slots", "date_overrides")
+            for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+        ],
+        # 固定課從程式常數搬進 DB，每個 tenant 各自設定
+        """
+        CREATE TABLE fixed_classes (
+            tenant TEXT NOT NULL,
+            weekday INTEGER NOT NULL CHECK (weekday BETWEEN 0 AND 6),
+            start_time TEXT NOT NULL,
+            end_time TEXT NOT NULL,
+            PRIMARY KEY (tenant, weekday, start_time)
+        )
+        """,
+        """
+        INSERT INTO fixed_classes (tenant, weekday, start_time, end_time) VALUES
+            ('default', 0, '19:00', '20:00'),
+            ('default', 4, '17:00', '17:45')
+        """,
+        "ALTER TABLE outbox ADD COLUMN tenant TEXT NOT NULL DEFAULT 'default'",
+        "DROP INDEX idx_outbox_status_next",
+        "CREATE INDEX idx_outbox_tenant_status_next ON outbox (tenant, status, next_attempt_at)",
+    ],
+    # v6：團體課，一個時段多個名額
+    # slots.capacity / booked 是名額與已訂人數，誰訂了記在 bookings（slots.user_id 不再使用）
+    # slots.status：available = 還有名額、booked = 額滿、blocked = 不開放
+    [
+        "ALTER TABLE slots ADD COLUMN capacity INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE slots ADD COLUMN booked INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE bookings (
+            tenant TEXT NOT NULL,
+            slot_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tenant, slot_id, user_id)
+        )
+        """,
+        # get_user_booked_slots / cancel_slot_by_time
+        "CREATE INDEX idx_bookings_tenant_user ON bookings (tenant, user_id, slot_id)",
+        """
+        INSERT INTO bookings (tenant, slot_id, user_id)
+        SELECT tenant, id, user_id FROM slots
+        WHERE status = 'booked' AND user_id IS NOT NULL
+        """,
+        "UPDATE slots SET booked = 1 WHERE status = 'booked'",
+        "DROP INDEX idx_slots_tenant_user_status_date",
+        # 固定課 capacity = 0：只擋掉同時段的一對一課（原本的行為）；> 0：開成團體課
+        "ALTER TABLE fixed_classes ADD COLUMN capacity INTEGER NOT NULL DEFAULT 0",
+    ],
+    # v7：暫留（選了時段還沒確認），佔住 slots.booked 的一個名額直到確認或過期
+    # 主鍵是 (tenant, user_id)：每位學員最多一筆，表的大小不會超過學員數
+    [
+        """
+        CREATE TABLE holds (
+            tenant TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            slot_id TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (tenant, user_id)
+        )
+        """,
+        # sweep：WHERE tenant = ? AND expires_at <= ?
+        "CREATE INDEX idx_holds_tenant_expires ON holds (tenant, expires_at)",
+    ],
+    # v8：處理過的 webhookEventId，擋掉 LINE 的重送（event_dedup.py）
+    [
+        """
+        CREATE TABLE webhook_events (
+            tenant TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            received_at REAL NOT NULL,
+            PRIMARY KEY (tenant, event_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX idx_webhook_events_received ON webhook_events (received_at)",
+    ],
+    # v9：slots 加整數主鍵 sid，postback 帶 sid，訂 / 取消 / 暫留都直接用主鍵
+    # bookings / holds 的 slot_id 改存 sid；slots.id（YYYY-MM-DDTHH:MM）留著當 generate_slots 的唯一鍵
+    # AUTOINCREMENT：刪掉的 sid 不會被重用，聊天室裡的舊按鈕不會指到別堂課
+    [
+        """
+        CREATE TABLE slots_v9 (
+            sid INTEGER PRIMARY KEY AUTOINCREMENT,
+            tenant TEXT NOT NULL DEFAULT 'default',
+            id TEXT NOT NULL,
+            date TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            status TEXT,
+            user_id TEXT,
+            capacity INTEGER NOT NULL DEFAULT 1,
+            booked INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (tenant, id)
+        )
+        """,
+        """
+        INSERT INTO slots_v9 (tenant, id, date, start_time, end_time, status, user_id, capacity, booked)
+        SELECT tenant, id, date, start_time, end_time, status, user_id, capacity, booked
+        FROM slots
+        ORDER BY tenant, date, start_time
+        """,
+        """
+        CREATE TABLE bookings_v9 (
+            tenant TEXT NOT NULL,
+            slot_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tenant, slot_id, user_id)
+        )
+        """,
+        """
+        INSERT INTO bookings_v9 (tenant, slot_id, user_id, created_at)
+        SELECT b.tenant, s.sid, b.user_id, b.created_at
+        FROM bookings b
+        JOIN slots_v9 s ON s.tenant = b.tenant AND s.id = b.slot_id
+        """,
+        """
+        CREATE TABLE holds_v9 (
+            tenant TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            slot_id INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (tenant, user_id)
+        )
+        """,
+        """
+        INSERT INTO holds_v9 (tenant, user_id, slot_id, expires_at)
+        SELECT h.tenant, h.user_id, s.sid, h.expires_at
+        FROM holds h
+        JOIN slots_v9 s ON s.tenant = h.tenant AND s.id = h.slot_id
+        """,
+        # 舊表的索引、trigger 會跟著 DROP
+        "DROP TABLE holds",
+        "DROP TABLE bookings",
+        "DROP TABLE slots",
+        "ALTER TABLE slots_v9 RENAME TO slots",
+        "ALTER TABLE bookings_v9 RENAME TO bookings",
+        "ALTER TABLE holds_v9 RENAME TO holds",
+        "CREATE INDEX idx_slots_tenant_status_date ON slots (tenant, status, date)",
+        "CREATE INDEX idx_slots_tenant_date_status_start ON slots (tenant, date, status, start_time)",
+        "CREATE INDEX idx_bookings_tenant_user ON bookings (tenant, user_id, slot_id)",
+        "CREATE INDEX idx_holds_tenant_expires ON holds (tenant, expires_at)",
+        *[
+            f"""
+            CREATE TRIGGER trg_slots_{op.lower()}_gen
+            AFTER {op} ON slots
+            BEGIN
+                INSERT OR IGNORE INTO availability_generation (tenant, gen) VALUES ({row}.tenant, 0);
+                UPDATE availability_generation SET gen = gen + 1 WHERE tenant = {row}.tenant;
+            END
+            """
+            for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))
+        ],
+    ],
+    # v10：prune 只刪自己 tenant 的紀錄：WHERE tenant = ? AND received_at < ?
+    [
+        "DROP INDEX idx_webhook_events_received",
+        "CREATE INDEX idx_webhook_events_tenant_received ON webhook_events (tenant, received_at)",
+    ],
+]
+
+
+def migrate(tenant=DEFAULT_TENANT):
+    """
+    把 tenant 所在的 DB 升到最新版本，回傳目前版本
+    每一版在自己的 BEGIN IMMEDIATE 交易裡重新確認版本，多個 worker 同時啟動也只會套用一次
+    """
+    conn = get_connection(tenant)
+
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < version:
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# ================= 跨 worker 快取一致性 =================
+
+
+def sync_availability(tenant=DEFAULT_TENANT):
+    """
+    確認本 process 裡 tenant 的可預約快取是否還有效，別的連線寫過就整個作廢
+    先看 PRAGMA data_version（不讀任何表，幾乎零成本），
+    有其他連線 commit 過才去讀這個 tenant 的 generation 比對
+    """
+    conn = get_connection(tenant)
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    key = (db_path(tenant), tenant)
+    if _local.data_versions.get(key) == data_version:
+        return
+
+    row = conn.execute(
+        "SELECT gen FROM availability_generation WHERE tenant = ?",
+        (tenant,)
+    ).fetchone()
+    availability_cache(tenant).sync_generation(row[0] if row else 0)
+    _local.data_versions[key] = data_version
+
+
+def availability_version(tenant=DEFAULT_TENANT):
+    """
+    本 process 看到的可預約資料版本，任何寫入（包括別的 worker）之後都會變
+    snapshot / render cache 這類衍生資料拿來判斷還能不能用
+    """
+    sync_availability(tenant)
+    return availability_cache(tenant).version
+
+# ================= 基本 =================
+
+
+def init_db(tenant=DEFAULT_TENANT):
+    migrate(tenant)
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_fixed_classes(tenant=DEFAULT_TENANT):
+    """tenant 的固定課 {(weekday, start_time): (end_time, capacity), ...}"""
+    cur = get_connection(tenant).cursor()
+    cur.execute(
+        "SELECT weekday, start_time, end_time, capacity FROM fixed_classes WHERE tenant = ?",
+        (tenant,)
     )
-    """)
+    return {(wd, start): (end, capacity) for wd, start, end, capacity in cur.fetchall()}
+
 
-    conn.commit()
-    conn.close()
+@timed(DB_SECONDS)
+@traced("sqlite")
+def set_fixed_class(weekday, start_time, end_time, capacity=0, tenant=DEFAULT_TENANT):
+    """
+    新增 / 修改固定課（weekday：date.weekday()，週一 = 0）
+    capacity = 0 只擋掉同時段的一對一課；> 0 產生時段時開成 capacity 人的團體課
+    只影響之後產生的時段
+    """
+    with transaction(tenant) as cur:
+        cur.execute("""
+            INSERT INTO fixed_classes (tenant, weekday, start_time, end_time, capacity)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (tenant, weekday, start_time) DO UPDATE
+            SET end_time = excluded.end_time,
+                capacity = excluded.capacity
+        """, (tenant, weekday, start_time, end_time, capacity))
 
 # ================= 判斷某天是否開課 =================
 
 
-def is_open_date(date_str: str) -> bool:
-    conn = get_connection()
-    cur = conn.cursor()
+@timed(DB_SECONDS)
+@traced("sqlite")
+def is_open_date(date_str: str, open_weekdays=OPEN_WEEKDAYS, tenant=DEFAULT_TENANT) -> bool:
+    cur = get_connection(tenant).cursor()
 
     cur.execute(
-        "SELECT status FROM date_overrides WHERE date = ?",
-        (date_str,)
+        "SELECT status FROM date_overrides WHERE tenant = ? AND date = ?",
+        (tenant, date_str)
     )
     row = cur.fetchone()
-    conn.close()
 
     if row:
         return row[0] == "open"
 
     weekday = datetime.strptime(date_str, "%Y-%m-%d").weekday()
-    return weekday <= 3   # 週一～週四開
+    return weekday in open_weekdays
 
-# ================= 查詢 =================
 
+def _to_date(value):
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    return value
 
-def get_available_dates():
-    conn = get_connection()
-    cur = conn.cursor()
 
+def iter_open_status(start, end, open_weekdays=OPEN_WEEKDAYS, tenant=DEFAULT_TENANT):
+    """
+    依序產生 [start, end] 每一天的 (date_str, status, source)
+    區間內的 overrides 只用一次 range query 取出，邊讀邊和日期合併，
+    區間再長也不會整段載進記憶體
+    """
+    start, end = _to_date(start), _to_date(end)
+
+    cur = get_connection(tenant).cursor()
     cur.execute("""
-        SELECT DISTINCT date
-        FROM slots
-        WHERE status = 'available'
+        SELECT date, status
+        FROM date_overrides
+        WHERE tenant = ?
+          AND date BETWEEN ? AND ?
         ORDER BY date
-    """)
-    rows = cur.fetchall()
-    conn.close()
+    """, (tenant, start.isoformat(), end.isoformat()))
+    override = cur.fetchone()
+
+    d = start
+    one_day = timedelta(days=1)
+    while d <= end:
+        date_str = d.isoformat()
+
+        while override and override[0] < date_str:
+            override = cur.fetchone()
+
+        if override and override[0] == date_str:
+            yield date_str, override[1], "override"
+        elif d.weekday() in open_weekdays:
+            yield date_str, "open", "default"
+        else:
+            yield date_str, "closed", "default"
+
+        d += one_day
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_open_status_for_range(days: int = 14, start=None, end=None,
+                              open_weekdays=OPEN_WEEKDAYS, tenant=DEFAULT_TENANT):
+    """
+    回傳 (date_str, status, source) 的 list
+    預設是從今天起 N 天；也可以直接給 start / end（date 或 YYYY-MM-DD，含頭尾）
+    status: 'open' / 'closed'
+    source: 'default' / 'override'
+    大範圍請直接用 iter_open_status
+    """
+    start = _to_date(start) if start else date.today()
+    end = _to_date(end) if end else start + timedelta(days=days - 1)
+    return list(iter_open_status(start, end, open_weekdays, tenant))
 
-    return [d for (d,) in rows if is_open_date(d)]
+# ================= 查詢 =================
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_available_dates(open_weekdays=OPEN_WEEKDAYS, tenant=DEFAULT_TENANT):
+    """
+    還有空堂、而且當天有開課的日期（走快取）
+    有 override 以 override 為準，否則看 open_weekdays（date.weekday()，週一 = 0）
+    """
+    rule = frozenset(open_weekdays)
+    cache = availability_cache(tenant)
+    if cache.enabled:
+        sync_availability(tenant)
+    return list(cache.get_dates(rule, lambda: _load_available_dates(rule, tenant)))
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_available_dates_page(open_weekdays=OPEN_WEEKDAYS, after=None, limit=21, tenant=DEFAULT_TENANT):
+    """
+    分頁版 get_available_dates：after 之後（不含）的 limit 天，回傳 (dates, 還有沒有下一頁)
+    快取開著就從快取的日期列表 bisect 切一段；沒開就用 keyset（date > after LIMIT n+1），只查這一頁
+    """
+    rule = frozenset(open_weekdays)
+    cache = availability_cache(tenant)
+    if cache.enabled:
+        sync_availability(tenant)
+        dates = cache.get_dates(rule, lambda: _load_available_dates(rule, tenant))
+        start = bisect.bisect_right(dates, after) if after else 0
+        page = dates[start:start + limit + 1]
+    else:
+        page = _load_available_dates(rule, tenant, after=after, limit=limit + 1)
+    return list(page[:limit]), len(page) > limit
+
+
+def _load_available_dates(open_weekdays, tenant, after=None, limit=None):
+    # SQLite 的 %w 是週日 = 0，換算成 date.weekday() 的編號
+    sqlite_weekdays = [(wd + 1) % 7 for wd in open_weekdays]
+    placeholders = ", ".join("?" * len(sqlite_weekdays))
+    params = [tenant, *sqlite_weekdays]
+
+    # 分頁：idx_slots_tenant_status_date 直接從 after 往後掃，掃到 limit 天就停
+    page = ""
+    if after:
+        page = "AND s.date > ?"
+        params.append(after)
+    limit_sql = ""
+    if limit:
+        limit_sql = "LIMIT ?"
+        params.append(limit)
+
+    cur = get_connection(tenant).cursor()
+    cur.execute(f"""
+        SELECT DISTINCT s.date
+        FROM slots s
+        LEFT JOIN date_overrides o ON o.tenant = s.tenant AND o.date = s.date
+        WHERE s.tenant = ?
+          AND s.status = 'available'
+          AND (
+                o.status = 'open'
+             OR (o.status IS NULL
+                 AND CAST(strftime('%w', s.date) AS INTEGER) IN ({placeholders}))
+          )
+          {page}
+        ORDER BY s.date
+        {limit_sql}
+    """, params)
+
+    return tuple(d for (d,) in cur.fetchall())
 
 
-def get_available_slots_by_date(date):
-    conn = get_connection()
-    cursor = conn.cursor()
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_available_slots_by_date(date, tenant=DEFAULT_TENANT):
+    """當天還有名額的 (date, start_time, end_time, seats_left, capacity, sid)（走快取）"""
+    cache = availability_cache(tenant)
+    if cache.enabled:
+        sync_availability(tenant)
+    return list(cache.get_slots(date, lambda: _load_available_slots(date, tenant)))
+
+
+def _load_available_slots(date, tenant):
+    cursor = get_connection(tenant).cursor()
 
     cursor.execute("""
-        SELECT date, start_time, end_time
+        SELECT date, start_time, end_time, capacity - booked, capacity, sid
         FROM slots
-        WHERE date = ?
+        WHERE tenant = ?
+          AND date = ?
           AND status = 'available'
         ORDER BY start_time
-    """, (date,))
+    """, (tenant, date))
+
+    return tuple(cursor.fetchall())
+
 
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_available_slots_for_dates(dates, tenant=DEFAULT_TENANT):
+    """多天一起查：{date: [(date, start_time, end_time, seats_left, capacity, sid), ...]}，快取沒有的用一條 IN 查完"""
+    cache = availability_cache(tenant)
+    if cache.enabled:
+        sync_availability(tenant)
+    found = cache.get_slots_many(dates, lambda missing: _load_available_slots_many(missing, tenant))
+    return {d: list(rows) for d, rows in found.items()}
 
 
-def get_all_slots_by_date(date):
-    conn = get_connection()
-    cursor = conn.cursor()
+def _load_available_slots_many(dates, tenant):
+    cursor = get_connection(tenant).cursor()
+
+    cursor.execute(f"""
+        SELECT date, start_time, end_time, capacity - booked, capacity, sid
+        FROM slots
+        WHERE tenant = ?
+          AND date IN ({",".join("?" * len(dates))})
+          AND status = 'available'
+        ORDER BY date, start_time
+    """, (tenant, *dates))
+
+    rows = {d: [] for d in dates}
+    for row in cursor.fetchall():
+        rows[row[0]].append(row)
+    return {d: tuple(r) for d, r in rows.items()}
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_all_slots_by_date(date, tenant=DEFAULT_TENANT):
+    """當天所有時段的 (date, start_time, end_time, status, booked, capacity)"""
+    cursor = get_connection(tenant).cursor()
 
     cursor.execute("""
-        SELECT date, start_time, end_time, status, user_id
+        SELECT date, start_time, end_time, status, booked, capacity
         FROM slots
-        WHERE date = ?
+        WHERE tenant = ?
+          AND date = ?
         ORDER BY start_time
-    """, (date,))
+    """, (tenant, date))
 
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return cursor.fetchall()
 
 
-def get_user_booked_slots(user_id):
-    conn = get_connection()
-    cursor = conn.cursor()
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_user_booked_slots(user_id, tenant=DEFAULT_TENANT):
+    """學員已預約的 (date, start_time, end_time, sid)"""
+    cursor = get_connection(tenant).cursor()
 
     cursor.execute("""
-        SELECT date, start_time, end_time
-        FROM slots
-        WHERE status = 'booked'
-          AND user_id = ?
-        ORDER BY date, start_time
-    """, (user_id,))
+        SELECT s.date, s.start_time, s.end_time, s.sid
+        FROM bookings b
+        JOIN slots s ON s.sid = b.slot_id
+        WHERE b.tenant = ?
+          AND b.user_id = ?
+        ORDER BY s.date, s.start_time
+    """, (tenant, user_id))
 
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    return cursor.fetchall()
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_user_booked_slots_for_users(user_ids, tenant=DEFAULT_TENANT):
+    """多位學員一起查：{user_id: [(date, start_time, end_time, sid), ...]}"""
+    user_ids = list(dict.fromkeys(user_ids))
+    cursor = get_connection(tenant).cursor()
+
+    cursor.execute(f"""
+        SELECT b.user_id, s.date, s.start_time, s.end_time, s.sid
+        FROM bookings b
+        JOIN slots s ON s.sid = b.slot_id
+        WHERE b.tenant = ?
+          AND b.user_id IN ({",".join("?" * len(user_ids))})
+        ORDER BY b.user_id, s.date, s.start_time
+    """, (tenant, *user_ids))
+
+    booked = {u: [] for u in user_ids}
+    for user_id, *slot in cursor.fetchall():
+        booked[user_id].append(tuple(slot))
+    return booked
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_tomorrow_bookings(tenant=DEFAULT_TENANT):
+    """明天所有已預約的 (user_id, date, start_time, end_time, sid)，團體課每位學員一筆，給提醒排程用"""
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    cursor = get_connection(tenant).cursor()
+
+    cursor.execute("""
+        SELECT b.user_id, s.date, s.start_time, s.end_time, s.sid
+        FROM slots s
+        JOIN bookings b ON b.tenant = s.tenant AND b.slot_id = s.sid
+        WHERE s.tenant = ?
+          AND s.date = ?
+        ORDER BY s.start_time
+    """, (tenant, tomorrow))
+
+    return cursor.fetchall()
+
+
+def get_tomorrow_schedule_for_coach(tenant=DEFAULT_TENANT):
+    """回傳 (明天日期, [(date, start_time, end_time), ...])，給教練課表提醒用（團體課只列一次）"""
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    rows = dict.fromkeys((d, start, end) for _, d, start, end, _ in get_tomorrow_bookings(tenant))
+    return tomorrow, list(rows)
 
 # ================= 動作 =================
 
 
-def book_slot(slot_id, user_id):
-    try:
-        date_part, time_part = slot_id.split("T", 1)
-        start, end = time_part.split("-", 1)
-    except ValueError:
-        return False
+@timed(DB_SECONDS)
+@traced("sqlite")
+def get_slot(slot, tenant=DEFAULT_TENANT):
+    """slot（sid 或舊格式字串）的 (sid, date, start_time, end_time)，沒有這堂回傳 None"""
+    return _slot_row(get_connection(tenant).cursor(), tenant, slot)
 
-    conn = get_connection()
-    cur = conn.cursor()
 
-    cur.execute("""
-        UPDATE slots
-        SET status = 'booked',
-            user_id = ?
-        WHERE date = ?
-          AND start_time = ?
-          AND end_time = ?
-          AND status = 'available'
-    """, (user_id, date_part, start, end))
+@timed(DB_SECONDS)
+@traced("sqlite")
+def book_slot(slot, user_id, notify=(), tenant=DEFAULT_TENANT):
+    """
+    佔一個名額；額滿、不開放或這位學員已經訂過都回傳 False
+    slot 是 slots.sid 或 get_slot 的結果；舊格式字串也收（見 _slot_row）
+    學員先用 hold_slot 暫留的話，直接把暫留轉成預約（名額已經佔好了）
+    notify: [(recipient, messages, dedupe_key), ...]
+    預約成功時在同一個交易寫進 outbox，預約失敗就不會有通知
+    """
+    with transaction(tenant, immediate=True) as cur:
+        dates = _sweep_holds(cur, tenant, time.time())
+        row = _slot_row(cur, tenant, slot)
+        success = False
 
-    success = cur.rowcount == 1
-    conn.commit()
-    conn.close()
+        if row is not None:
+            sid, date_part = row[0], row[1]
+            cur.execute(
+                "DELETE FROM holds WHERE tenant = ? AND user_id = ? AND slot_id = ?",
+                (tenant, user_id, sid)
+            )
+            held = cur.rowcount == 1
+
+            if held or _claim_seat(cur, tenant, sid):
+                cur.execute("""
+                    INSERT INTO bookings (tenant, slot_id, user_id)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (tenant, slot_id, user_id) DO NOTHING
+                """, (tenant, sid, user_id))
+                success = cur.rowcount == 1
+                if not success:
+                    # 已經訂過這堂，剛佔的名額還回去
+                    _release_seats(cur, tenant, sid)
+
+            if success:
+                dates.add(date_part)
+                for recipient, messages, dedupe_key in notify:
+                    enqueue_outbox(cur, recipient, messages, dedupe_key, tenant=tenant)
+
+    if dates:
+        availability_cache(tenant).invalidate(*dates)
     return success
 
 
-def get_open_status_for_range(days: int = 14):
+@timed(DB_SECONDS)
+@traced("sqlite")
+def cancel_booking(slot, user_id, notify=(), tenant=DEFAULT_TENANT):
     """
-    回傳未來 N 天的 (date_str, status, source)
-    status: 'open' / 'closed'
-    source: 'default' / 'override'
+    取消學員在 slot（sid / get_slot 的結果，舊格式字串也收）的預約，釋出一個名額
+    notify 同 book_slot，取消成功才寫進 outbox
     """
-    today = date.today()
-    results = []
+    with transaction(tenant, immediate=True) as cur:
+        row = _slot_row(cur, tenant, slot)
+        success = False
+
+        if row is not None:
+            cur.execute(
+                "DELETE FROM bookings WHERE tenant = ? AND slot_id = ? AND user_id = ?",
+                (tenant, row[0], user_id)
+            )
+            success = cur.rowcount == 1
 
-    for i in range(days):
-        d = today + timedelta(days=i)
-        date_str = d.strftime("%Y-%m-%d")
+        if success:
+            _release_seats(cur, tenant, row[0])
+            for recipient, messages, dedupe_key in notify:
+                enqueue_outbox(cur, recipient, messages, dedupe_key, tenant=tenant)
 
-        conn = get_connection()
-        cur = conn.cursor()
+    if success:
+        availability_cache(tenant).invalidate(row[1])
+    return success
+
+
+def cancel_slot_by_time(date_str, start_time, end_time, user_id, notify=(), tenant=DEFAULT_TENANT):
+    """用 date + 時間取消（舊的呼叫方式，CANCEL_CONFIRM|date|start|end 的舊按鈕也走這裡）"""
+    return cancel_booking(f"{date_str}T{start_time}-{end_time}", user_id, notify, tenant)
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def set_date_override(date_str, status, reason=None, tenant=DEFAULT_TENANT):
+    """
+    指定某天開課 / 停課（status: 'open' / 'closed'），蓋過預設的星期規則
+    """
+    with transaction(tenant) as cur:
+        cur.execute("""
+            INSERT INTO date_overrides (tenant, date, status, reason)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (tenant, date) DO UPDATE
+            SET status = excluded.status,
+                reason = excluded.reason,
+                updated_at = CURRENT_TIMESTAMP
+        """, (tenant, date_str, status, reason))
+
+    availability_cache(tenant).invalidate(date_str)
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def clear_date_override(date_str, tenant=DEFAULT_TENANT):
+    """移除某天的 override，回到預設的星期規則"""
+    with transaction(tenant) as cur:
         cur.execute(
-            "SELECT status FROM date_overrides WHERE date = ?",
-            (date_str,)
+            "DELETE FROM date_overrides WHERE tenant = ? AND date = ?",
+            (tenant, date_str)
         )
-        row = cur.fetchone()
-        conn.close()
 
-        if row:
-            results.append((date_str, row[0], "override"))
-        else:
-            weekday = d.weekday()
-            if weekday <= 3:
-                results.append((date_str, "open", "default"))
-            else:
-                results.append((date_str, "closed", "default"))
+    availability_cache(tenant).invalidate(date_str)
 
-    return results
+# ================= 暫留 =================
 
+# 學員選了時段、還沒按確認之前先佔住名額，別人看到的就是已額滿
+# 每位學員同時只有一個暫留，過期的由 sweep 還回名額
 
-def cancel_slot_by_time(date_str, start_time, end_time, user_id):
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def hold_slot(slot, user_id, ttl=None, tenant=DEFAULT_TENANT):
     """
-    取消指定時段的預約（使用 date + time）
+    暫留 slot（sid / get_slot 的結果，舊格式字串也收）ttl 秒（預設 HOLD_TTL），回傳是否成功
+    同一個時段重選只會延長期限；改選別的時段，成功後原本的暫留就放掉
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    if ttl is None:
+        ttl = int(os.getenv("HOLD_TTL", "300"))
+    now = time.time()
+
+    with transaction(tenant, immediate=True) as cur:
+        dates = _sweep_holds(cur, tenant, now)
+        row = _slot_row(cur, tenant, slot)
+        success = False
+
+        if row is not None:
+            sid, date_part = row[0], row[1]
+            cur.execute("""
+                SELECT h.slot_id, s.date
+                FROM holds h
+                JOIN slots s ON s.sid = h.slot_id
+                WHERE h.tenant = ?
+                  AND h.user_id = ?
+            """, (tenant, user_id))
+            previous = cur.fetchone()
 
+            cur.execute(
+                "SELECT 1 FROM bookings WHERE tenant = ? AND slot_id = ? AND user_id = ?",
+                (tenant, sid, user_id)
+            )
+            already_booked = cur.fetchone() is not None
+
+            if previous and previous[0] == sid:
+                success = True
+            elif not already_booked and _claim_seat(cur, tenant, sid):
+                success = True
+                dates.add(date_part)
+                if previous:
+                    _release_seats(cur, tenant, previous[0])
+                    dates.add(previous[1])
+
+            if success:
+                cur.execute("""
+                    INSERT INTO holds (tenant, user_id, slot_id, expires_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (tenant, user_id) DO UPDATE
+                    SET slot_id = excluded.slot_id,
+                        expires_at = excluded.expires_at
+                """, (tenant, user_id, sid, now + ttl))
+
+    if dates:
+        availability_cache(tenant).invalidate(*dates)
+    return success
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def release_hold(user_id, tenant=DEFAULT_TENANT):
+    """學員按「上一步」時放掉自己的暫留，回傳有沒有放掉；沒有暫留就不拿寫鎖"""
+    cur = get_connection(tenant).cursor()
+    cur.execute("SELECT 1 FROM holds WHERE tenant = ? AND user_id = ?", (tenant, user_id))
+    if cur.fetchone() is None:
+        return False
+
+    with transaction(tenant, immediate=True) as cur:
+        cur.execute("""
+            SELECT h.slot_id, s.date
+            FROM holds h
+            JOIN slots s ON s.sid = h.slot_id
+            WHERE h.tenant = ?
+              AND h.user_id = ?
+        """, (tenant, user_id))
+        held = cur.fetchone()
+        if held is not None:
+            _release_seats(cur, tenant, held[0])
+            cur.execute("DELETE FROM holds WHERE tenant = ? AND user_id = ?", (tenant, user_id))
+
+    if held is None:
+        return False
+    availability_cache(tenant).invalidate(held[1])
+    return True
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def sweep_expired_holds(tenant=DEFAULT_TENANT):
+    """
+    把過期的暫留還回名額，回傳還了幾個
+    先用索引看有沒有過期的，沒有就不拿寫鎖
+    """
+    now = time.time()
+    cur = get_connection(tenant).cursor()
+    cur.execute(
+        "SELECT 1 FROM holds WHERE tenant = ? AND expires_at <= ? LIMIT 1",
+        (tenant, now)
+    )
+    if cur.fetchone() is None:
+        return 0
+
+    with transaction(tenant, immediate=True) as cur:
+        dates = _sweep_holds(cur, tenant, now)
+        released = cur.rowcount if dates else 0   # 最後一句是 DELETE holds
+
+    if dates:
+        availability_cache(tenant).invalidate(*dates)
+    return released
+
+
+def _sweep_holds(cur, tenant, now):
+    """在呼叫端的交易裡刪掉過期暫留、還回名額，回傳受影響的日期"""
     cur.execute("""
-        UPDATE slots
-        SET status = 'available',
-            user_id = NULL
-        WHERE date = ?
+        SELECT h.slot_id, s.date, COUNT(*)
+        FROM holds h
+        JOIN slots s ON s.sid = h.slot_id
+        WHERE h.tenant = ?
+          AND h.expires_at <= ?
+        GROUP BY h.slot_id
+    """, (tenant, now))
+    expired = cur.fetchall()
+    if not expired:
+        return set()
+
+    for slot, _, count in expired:
+        _release_seats(cur, tenant, slot, count)
+    cur.execute(
+        "DELETE FROM holds WHERE tenant = ? AND expires_at <= ?",
+        (tenant, now)
+    )
+    return {d for _, d, _ in expired}
+
+# ===== 名額（訂位 / 取消 / 暫留共用）=====
+
+
+def parse_legacy_slot_id(slot_id):
+    """v9 以前 postback 裡的 YYYY-MM-DDTHH:MM-HH:MM，回傳 (date, start, end)；格式不對丟 ValueError"""
+    date_part, time_part = slot_id.split("T", 1)
+    start, end = time_part.split("-", 1)
+    return date_part, start, end
+
+
+def _slot_row(cur, tenant, slot):
+    """
+    (sid, date, start_time, end_time)
+    slot 是 get_slot 查好的 tuple 就直接用（handler 要顯示時間時已經查過，不用再查一次）；
+    int 用主鍵查；字串是聊天室裡還留著的舊按鈕，用 date + 時間查一次
+    """
+    if isinstance(slot, tuple):
+        return slot
+    if isinstance(slot, int):
+        cur.execute("""
+            SELECT sid, date, start_time, end_time FROM slots
+            WHERE sid = ?
+              AND tenant = ?
+        """, (slot, tenant))
+        return cur.fetchone()
+
+    try:
+        date_part, start, end = parse_legacy_slot_id(slot)
+    except ValueError:
+        return None
+    cur.execute("""
+        SELECT sid, date, start_time, end_time FROM slots
+        WHERE tenant = ?
+          AND date = ?
           AND start_time = ?
           AND end_time = ?
-          AND status = 'booked'
-          AND user_id = ?
-    """, (date_str, start_time, end_time, user_id))
+    """, (tenant, date_part, start, end))
+    return cur.fetchone()
 
-    success = cur.rowcount == 1
-    conn.commit()
-    conn.close()
-    return success
+
+def _claim_seat(cur, tenant, sid):
+    """
+    還有名額才會 booked + 1（額滿就切成 booked），回傳是否佔到
+    條件寫在同一個主鍵 UPDATE 裡，併發時最後一個名額只會有一個人拿到
+    """
+    cur.execute("""
+        UPDATE slots
+        SET booked = booked + 1,
+            status = CASE WHEN booked + 1 >= capacity THEN 'booked' ELSE status END
+        WHERE sid = ?
+          AND tenant = ?
+          AND status = 'available'
+          AND booked < capacity
+    """, (sid, tenant))
+    return cur.rowcount == 1
+
+
+def _release_seats(cur, tenant, sid, count=1):
+    """還回 count 個名額，額滿的時段切回 available（blocked 不動）"""
+    cur.execute("""
+        UPDATE slots
+        SET booked = booked - ?,
+            status = CASE WHEN status = 'booked' THEN 'available' ELSE status END
+        WHERE sid = ?
+          AND tenant = ?
+    """, (count, sid, tenant))
+
+# ================= Webhook 去重 =================
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def claim_webhook_events(event_ids, tenant=DEFAULT_TENANT):
+    """
+    記下這批 webhookEventId，回傳第一次看到的那些（list）
+    已經有紀錄的就是重送（可能是別的 worker 收過），呼叫端不要再處理
+    """
+    now = time.time()
+    claimed = []
+
+    with transaction(tenant) as cur:
+        for event_id in event_ids:
+            cur.execute("""
+                INSERT INTO webhook_events (tenant, event_id, received_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (tenant, event_id) DO NOTHING
+            """, (tenant, event_id, now))
+            if cur.rowcount == 1:
+                claimed.append(event_id)
+
+    return claimed
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def forget_webhook_events(event_ids, tenant=DEFAULT_TENANT):
+    """處理失敗 / 沒處理到的事件移除紀錄，LINE 重送時才會再處理一次"""
+    with transaction(tenant) as cur:
+        cur.executemany(
+            "DELETE FROM webhook_events WHERE tenant = ? AND event_id = ?",
+            [(tenant, event_id) for event_id in event_ids]
+        )
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def prune_webhook_events(older_than, tenant=DEFAULT_TENANT):
+    """刪掉 tenant 裡 received_at 早於 older_than（epoch 秒）的紀錄，回傳筆數"""
+    with transaction(tenant) as cur:
+        cur.execute(
+            "DELETE FROM webhook_events WHERE tenant = ? AND received_at < ?",
+            (tenant, older_than)
+        )
+        return cur.rowcount
+
+# ================= Outbox =================
+
+
+@timed(DB_SECONDS)
+@traced("sqlite")
+def enqueue_outbox(cur, recipient, messages, dedupe_key=None, tenant=DEFAULT_TENANT):
+    """
+    在呼叫端的交易裡寫入一筆待送 push（跟著同一個 commit / rollback）
+    tenant 決定之後用哪個 channel 的 token 送出
+    同一個 tenant 裡 dedupe_key 相同的只會保留第一筆，回傳是否有寫入
+    """
+    cur.execute("""
+        INSERT INTO outbox (tenant, dedupe_key, recipient, payload)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (dedupe_key) DO NOTHING
+    """, (
+        tenant,
+        f"{tenant}:{dedupe_key}" if dedupe_key else None,
+        recipient,
+        json.dumps(to_payload(messages), ensure_ascii=False),
+    ))
+
+    return cur.rowcount == 1
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+from db import claim_webhook_events, forget_webhook_events, prune_webhook_events
+
+
+class EventDeduplicator:
+    """
+    webhookEventId 去重，LINE 重送的事件（isRedelivery）不會被處理第二次
+
+    - 先查 in-process LRU（O(1)），同一個 worker 收過的直接丟掉，不碰 DB
+    - LRU 沒有的再寫 SQLite（webhook_events），跨 worker 也只會有一個人處理
+    - LRU 最多 max_size 筆；SQLite 每寫 prune_every 次刪一次超過 ttl 秒的紀錄
+    """
+
+    def __init__(self, max_size=10000, ttl=86400, prune_every=1000):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.duplicates = 0
+        self._recent = OrderedDict()
+        self._claims = 0
+        self._lock = threading.Lock()
+
+    def is_recent(self, tenant, event_id):
+        """本 process 最近收過（不查 DB）"""
+        key = (tenant, event_id)
+        with self._lock:
+            if key in self._recent:
+                self._recent.move_to_end(key)
+                self.duplicates += 1
+                return True
+        return False
+
+    def claim(self, tenant, event_ids):
+        """
+        回傳這批裡第一次看到、應該處理的 event_id（set）
+        會寫 SQLite，async 程式請丟到 threadpool
+        """
+        with self._lock:
+            fresh = [e for e in dict.fromkeys(event_ids) if (tenant, e) not in self._recent]
+        if not fresh:
+            self.duplicates += len(event_ids)
+            return set()
+
+        claimed = set(claim_webhook_events(fresh, tenant))
+
+        with self._lock:
+            self.duplicates += len(event_ids) - len(claimed)
+            # 只記自己處理的；別的 worker 的交給 DB 判斷，對方 forget 後才能重新處理
+            for event_id in claimed:
+                self._recent[(tenant, event_id)] = None
+            while len(self._recent) > self.max_size:
+                self._recent.popitem(last=False)
+            self._claims += 1
+            prune = self._claims % self.prune_every == 0
+
+        if prune:
+            prune_webhook_events(time.time() - self.ttl, tenant)
+        return claimed
+
+    def forget(self, tenant, *event_ids):
+        """處理失敗 / 沒處理到：移除紀錄，讓 LINE 重送時可以再處理"""
+        with self._lock:
+            for event_id in event_ids:
+                self._recent.pop((tenant, event_id), None)
+        forget_webhook_events(event_ids, tenant)
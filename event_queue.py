@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class DispatcherBusy(Exception):
+    """收下的事件已達上限，在 put_timeout 內排不進去"""
+
+
+class EventDispatcher:
+    """
+    背景事件處理
+
+    - 同一個 key（tenant:user_id）的事件依序處理：有事件在等的 key 各有一條 task，
+      把自己的事件處理完就結束；不同 key 互不等待，一個人的 LINE 回覆慢不會卡到別人
+    - 同時在跑的 handler 最多 workers 個（semaphore）
+    - 收下還沒處理完的事件最多 queue_size 個，滿了就等 put_timeout，
+      還是排不進去就丟 DispatcherBusy，讓 webhook 回 503（LINE 會重送）
+    """
+
+    def __init__(self, handler, workers=32, queue_size=100, put_timeout=5.0):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.put_timeout = put_timeout
+        self._chains = {}   # key -> deque（還沒開始處理的事件）
+        self._tasks = set()
+        self._waiting = 0
+        self._capacity = None
+        self._running = None
+
+    async def start(self):
+        self._capacity = asyncio.Semaphore(self.queue_size)
+        self._running = asyncio.Semaphore(self.workers)
+
+    async def stop(self):
+        # 先把已收下的事件處理完
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, key, item):
+        try:
+            await asyncio.wait_for(self._capacity.acquire(), timeout=self.put_timeout)
+        except asyncio.TimeoutError:
+            raise DispatcherBusy(f"queue full (key={key})")
+
+        self._waiting += 1
+        chain = self._chains.get(key)
+        if chain is not None:
+            # 這個 key 已經有 task 在處理，排在它後面
+            chain.append(item)
+            return
+
+        self._chains[key] = deque([item])
+        task = asyncio.create_task(self._run_chain(key), name=f"event-chain-{key}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def qsize(self):
+        """收下了、還沒開始處理的事件數"""
+        return self._waiting
+
+    async def _run_chain(self, key):
+        chain = self._chains[key]
+        try:
+            while chain:
+                item = chain.popleft()
+                try:
+                    async with self._running:
+                        self._waiting -= 1
+                        await self.handler(item)
+                except Exception:
+                    logger.exception("event handler failed")
+                finally:
+                    self._capacity.release()
+        finally:
+            # chain 空了到這裡之間沒有 await，不會漏掉新排進來的事件
+            del self._chains[key]
@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from line_client import LineApiError, RETRY_STATUS, to_payload
+
+logger = logging.getLogger(__name__)
+
+# LINE multicast 一次最多 500 人
+MULTICAST_LIMIT = 500
+
+
+class TokenBucket:
+    """每秒補 rate 個 token，最多存 burst 個；拿不到就等"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def group_by_content(jobs):
+    """
+    jobs: [(user_id, messages), ...] 或 [(user_id, messages, retry_key), ...]
+    內容完全相同的合併成一組，回傳 [(job_indexes, user_ids, payload), ...]
+    """
+    groups = {}
+    for i, (user_id, messages, *_) in enumerate(jobs):
+        payload = to_payload(messages)
+        key = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        group = groups.setdefault(key, (payload, [], []))
+        group[1].append(i)
+        group[2].append(user_id)
+
+    batches = []
+    for payload, indexes, user_ids in groups.values():
+        for i in range(0, len(user_ids), MULTICAST_LIMIT):
+            batches.append((
+                indexes[i:i + MULTICAST_LIMIT],
+                user_ids[i:i + MULTICAST_LIMIT],
+                payload,
+            ))
+    return batches
+
+
+def retry_key(jobs, indexes):
+    """
+    這次呼叫的 X-Line-Retry-Key：單人就是 job 自己的 key，multicast 由組內的 key 算出來
+    同一批重送（例如 outbox 重新領取）會拿到同一個 key，LINE 不會送第二次；有 job 沒給 key 就回 None
+    """
+    keys = [jobs[i][2] if len(jobs[i]) > 2 else None for i in indexes]
+    if None in keys:
+        return None
+    if len(keys) == 1:
+        return keys[0]
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, "|".join(sorted(keys))))
+
+
+async def fan_out(line_client, jobs, rate=20.0, concurrency=10):
+    """
+    併發送出大量 push，回傳統計
+    {"sent", "failed", "retried", "requests", "errors"}
+    sent / failed 以人數計；errors 是 {jobs 的 index: 例外}
+
+    - 相同內容的使用者合併成 multicast
+    - multicast 收到 4xx（通常是其中一個收件人有問題）就拆成單人 push 重送，只有真的送不到的算失敗
+    - job 帶 retry_key 時，API 呼叫帶上由它算出的 X-Line-Retry-Key（見 retry_key()）
+    - 每個 API 呼叫先過 token bucket 限速
+    - 暫時性錯誤由 line_client 重試；重試完還是失敗只記 failed，不中斷其他人
+    """
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"sent": 0, "failed": 0, "retried": 0, "requests": 0, "errors": {}}
+    retries_before = line_client.retries
+
+    async def send(indexes, user_ids, payload):
+        key = retry_key(jobs, indexes)
+        async with semaphore:
+            await bucket.acquire()
+            stats["requests"] += 1
+            try:
+                if len(user_ids) == 1:
+                    await line_client.push_message(user_ids[0], payload, retry_key=key)
+                else:
+                    await line_client.multicast(user_ids, payload, retry_key=key)
+            except Exception as e:
+                error = e
+            else:
+                stats["sent"] += len(user_ids)
+                return
+
+        if len(user_ids) > 1 and isinstance(error, LineApiError) and error.status_code not in RETRY_STATUS:
+            logger.warning("multicast to %d users failed, retrying one by one: %s", len(user_ids), error)
+            await asyncio.gather(*(send([i], [u], payload) for i, u in zip(indexes, user_ids)))
+            return
+
+        logger.warning("push to %d user(s) failed: %s", len(user_ids), error)
+        stats["failed"] += len(user_ids)
+        for i in indexes:
+            stats["errors"][i] = error
+
+    await asyncio.gather(*(send(*batch) for batch in group_by_content(jobs)))
+
+    stats["retried"] = line_client.retries - retries_before
+    return stats
@@ -0,0 +1,19 @@
+"""
+JSON 編解碼：有裝 orjson 就用（快好幾倍），沒有就退回標準庫
+dumps 一律回傳 UTF-8 bytes，可以直接當 HTTP body
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+    dumps = orjson.dumps
+else:
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
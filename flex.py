@@ -1,49 +1,82 @@
-from collections import defaultdict
+from datetime import date as today_date
 
-def build_schedule_carousel(slots):
+from date_labels import parse_date
+from flex_date_picker import date_button
+from tracing import traced
+
+
+@traced("flex")
+def build_date_carousel(dates, page, next_cursor=None, today=None, per_bubble=7):
     """
-    slots: [(slot_id, date, start_time, end_time), ...]
+    日期很多時的分頁 date picker：一頁是一個 carousel，每 per_bubble 天一張 bubble
+    next_cursor：這一頁最後一天，有下一頁才給，放進 DATE_PAGE|<頁碼>|<cursor>（keyset，下一頁從這天之後查）
+    LINE 的 carousel 最多 12 張 bubble，len(dates) / per_bubble 由呼叫端控制
     """
-    grouped = defaultdict(list)
-
-    for slot_id, date, start, end in slots:
-        grouped[date].append((slot_id, start, end))
+    today = today or today_date.today()
+    chunks = [dates[i:i + per_bubble] for i in range(0, len(dates), per_bubble)]
 
     bubbles = []
-
-    for date, day_slots in grouped.items():
-        contents = [
-            {
-                "type": "text",
-                "text": f"日期 {date}",
-                "weight": "bold",
-                "size": "lg"
-            }
-        ]
-
-    for slot_id, start, end in day_slots[:5]:
-        contents.append({
-            "type": "button",
-            "style": "secondary",
-            "action": {
-                "type": "postback",
-                "label": f"{start}–{end}",
-                "data": f"SLOT|{date}T{start}-{end}"
-            }
-        })
-
-
+    for chunk in chunks:
+        first, last = parse_date(chunk[0]), parse_date(chunk[-1])
         bubbles.append({
             "type": "bubble",
+            "size": "kilo",
             "body": {
                 "type": "box",
                 "layout": "vertical",
                 "spacing": "md",
-                "contents": contents
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": "📅 選擇預約日期（1 / 3）",
+                        "weight": "bold",
+                        "size": "md"
+                    },
+                    {
+                        "type": "text",
+                        "text": f"{first.month}/{first.day} – {last.month}/{last.day}",
+                        "size": "sm",
+                        "color": "#666666"
+                    },
+                    {
+                        "type": "box",
+                        "layout": "vertical",
+                        "spacing": "sm",
+                        "contents": [date_button(d, today) for d in chunk]
+                    }
+                ]
             }
         })
 
+    # ===== 換頁按鈕放在最後一張 =====
+    nav = []
+    if page > 1:
+        nav.append(page_button("⬅ 回第一頁", "DATE_PAGE|1"))
+    if next_cursor:
+        nav.append(page_button("下一頁 ➡", f"DATE_PAGE|{page + 1}|{next_cursor}"))
+
+    if nav and bubbles:
+        bubbles[-1]["footer"] = {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "sm",
+            "contents": nav
+        }
+
     return {
         "type": "carousel",
         "contents": bubbles
     }
+
+
+def page_button(label, data):
+    """換頁用的 link 按鈕（flex_day_slots 也用）"""
+    return {
+        "type": "button",
+        "style": "link",
+        "action": {
+            "type": "postback",
+            "label": label,
+            "data": data
+        }
+    }
@@ -1,4 +1,8 @@
-def build_cancel_confirm_flex(date, start, end):
+from tracing import traced
+
+
+@traced("flex")
+def build_cancel_confirm_flex(slot_id, date, start, end):
     return {
         "type": "bubble",
         "body": {
@@ -28,7 +32,7 @@ def build_cancel_confirm_flex(date, start, end):
                     "action": {
                         "type": "postback",
                         "label": "確認取消",
-                        "data": f"CANCEL_CONFIRM|{date}|{start}|{end}"
+                        "data": f"CANCEL_CONFIRM|{slot_id}"
                     }
                 },
                 {
@@ -0,0 +1,43 @@
+from tracing import traced
+
+
+@traced("flex")
+def build_cancel_list_flex(slots):
+    """
+    slots: [(date, start_time, end_time, sid), ...]
+    """
+    buttons = []
+
+    for date, start, end, sid in slots:
+        buttons.append({
+            "type": "button",
+            "style": "secondary",
+            "action": {
+                "type": "postback",
+                "label": f"{date} {start}–{end}",
+                "data": f"CANCEL_PREVIEW|{sid}"
+            }
+        })
+
+    return {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "spacing": "md",
+            "contents": [
+                {
+                    "type": "text",
+                    "text": "❌ 選擇要取消的課程",
+                    "weight": "bold",
+                    "size": "lg"
+                },
+                {
+                    "type": "box",
+                    "layout": "vertical",
+                    "spacing": "sm",
+                    "contents": buttons
+                }
+            ]
+        }
+    }
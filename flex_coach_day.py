@@ -1,8 +1,15 @@
+from tracing import traced
+
+
+@traced("flex")
 def build_coach_day_flex(date, slots):
     contents = []
 
-    for _, _, start, end, status, student in slots:
-        if status == "booked":
+    for _, start, end, status, booked, capacity in slots:
+        if capacity > 1 and status != "blocked":
+            label = f"{start}-{end} 團體課 {booked}/{capacity}"
+            color = "#E53935" if status == "booked" else "#1E88E5"
+        elif status == "booked":
             label = f"{start}-{end} 已預約"
             color = "#E53935"
         elif status == "blocked":
@@ -1,11 +1,9 @@
-from datetime import datetime
+from date_labels import display_date
+from tracing import traced
 
 
+@traced("flex")
 def build_confirm_flex(slot_id, date, start, end):
-    dt = datetime.strptime(date, "%Y-%m-%d")
-    weekday = ["一", "二", "三", "四", "五", "六", "日"][dt.weekday()]
-    display_date = f"{dt.month}/{dt.day}（週{weekday}）"
-
     return {
         "type": "bubble",
         "body": {
@@ -32,7 +30,7 @@ def build_confirm_flex(slot_id, date, start, end):
                     "contents": [
                         {
                             "type": "text",
-                            "text": f"📅 日期：{display_date}"
+                            "text": f"📅 日期：{display_date(date)}"
                         },
                         {
                             "type": "text",
@@ -1,45 +1,36 @@
-from datetime import datetime, date as today_date
+from datetime import date as today_date
 
-WEEKDAY_MAP = {
-    0: "一",
-    1: "二",
-    2: "三",
-    3: "四",
-    4: "五",
-    5: "六",
-    6: "日",
-}
+from date_labels import parse_date, relative_tag, weekday_name
+from tracing import traced
 
 
-def build_date_picker(dates):
-    buttons = []
-    today = today_date.today()
+def date_button(d, today):
+    """一個日期的按鈕；分頁的 carousel（flex.build_date_carousel）也用這個"""
+    # d 格式：YYYY-MM-DD
+    dt = parse_date(d)
 
-    for d in dates:
-        # d 格式：YYYY-MM-DD
-        dt = datetime.strptime(d, "%Y-%m-%d")
-        weekday = WEEKDAY_MAP[dt.weekday()]
+    # ===== UX：今天 / 明天提示 =====
+    tag = relative_tag(d, today)
 
-        # ===== UX：今天 / 明天提示 =====
-        tag = ""
-        delta = (dt.date() - today).days
-        if delta == 0:
-            tag = "（今天）"
-        elif delta == 1:
-            tag = "（明天）"
+    # 顯示用 label（人類友善）
+    label = f"{dt.month}/{dt.day}{tag}（週{weekday_name(d)}）"
+
+    return {
+        "type": "button",
+        "style": "secondary",
+        "action": {
+            "type": "postback",
+            "label": label,
+            "data": f"DATE|{d}"  # 後端仍使用 YYYY-MM-DD
+        }
+    }
 
-        # 顯示用 label（人類友善）
-        label = f"{dt.month}/{dt.day}{tag}（週{weekday}）"
 
-        buttons.append({
-            "type": "button",
-            "style": "secondary",
-            "action": {
-                "type": "postback",
-                "label": label,
-                "data": f"DATE|{d}"  # 後端仍使用 YYYY-MM-DD
-            }
-        })
+@traced("flex")
+def build_date_picker(dates, today=None):
+    """today 會影響「今天 / 明天」提示，快取時要放進 key"""
+    today = today or today_date.today()
+    buttons = [date_button(d, today) for d in dates]
 
     return {
         "type": "bubble",
@@ -1,21 +1,28 @@
-def build_day_slots(date, slots):
+from flex import page_button
+from tracing import traced
+
+
+@traced("flex")
+def build_day_slots(date, slots, next_cursor=None, first_page=True):
     """
-    slots: DB 回傳的 tuple（欄位數不固定）
-    只取最後兩個欄位作為 start / end
+    slots: get_available_slots_by_date 回傳的 (date, start, end, seats_left, capacity, sid)
+    團體課在按鈕上顯示剩餘名額
+    時段多的日子分頁：next_cursor 是這頁最後一堂的 start，放進 DAY_PAGE|<date>|<cursor>
     """
     buttons = []
 
-    for row in slots:
-        start = row[-2]
-        end = row[-1]
+    for _, start, end, seats_left, capacity, sid in slots:
+        label = f"{start}–{end}"
+        if capacity > 1:
+            label += f"（剩 {seats_left} 位）"
 
         buttons.append({
             "type": "button",
             "style": "secondary",
             "action": {
                 "type": "postback",
-                "label": f"{start}–{end}",
-                "data": f"SLOT|{date}T{start}-{end}"
+                "label": label,
+                "data": f"SLOT|{sid}"
             }
         })
 
@@ -27,6 +34,12 @@ def build_day_slots(date, slots):
             "color": "#999999"
         })
 
+    # ===== 分頁 =====
+    if next_cursor:
+        buttons.append(page_button("更多時段 ➡", f"DAY_PAGE|{date}|{next_cursor}"))
+    if not first_page:
+        buttons.append(page_button("⬅ 前面的時段", f"DATE|{date}"))
+
     return {
         "type": "bubble",
         "body": {
@@ -1,13 +1,11 @@
-from datetime import datetime, timedelta
-import sqlite3
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from dotenv import load_dotenv
 
-DB_NAME = "booking.db"
+from db import DEFAULT_TENANT, init_db, transaction, availability_cache, get_fixed_classes
 
-# 🔒 固定課設定
-FIXED_CLASSES = [
-    {"weekday": 0, "start": "19:00", "end": "20:00"},  # 週一
-    {"weekday": 4, "start": "17:00", "end": "17:45"},  # 週三
-]
+# 🔒 固定課改存在 fixed_classes 表，每個 tenant 各自設定
 
 # 🕒 教練可上課時段（每天）
 DAILY_TIME_SLOTS = [
@@ -18,37 +16,95 @@ DAILY_TIME_SLOTS = [
     ("19:00", "20:00"),
 ]
 
+
 def get_next_week_dates():
     today = datetime.today()
     start = today + timedelta(days=(7 - today.weekday()))
     return [start + timedelta(days=i) for i in range(7)]
 
-def is_fixed_class(date, start_time):
-    for fc in FIXED_CLASSES:
-        if date.weekday() == fc["weekday"] and start_time == fc["start"]:
-            return True
-    return False
 
-def generate_slots():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+def build_slot_rows(start, end, tenant=DEFAULT_TENANT):
+    """
+    tenant 在 [start, end]（含頭尾）每天的時段列
+    (tenant, id, date, start_time, end_time, status, capacity)
+    固定課 capacity = 0 把同時段的一對一課標成 blocked；> 0 開成團體課
+    """
+    fixed = get_fixed_classes(tenant)
+    group_classes = {
+        key: (end_time, capacity)
+        for key, (end_time, capacity) in fixed.items() if capacity > 0
+    }
 
-    for date in get_next_week_dates():
-        date_str = date.strftime("%Y-%m-%d")
+    d = start
+    while d <= end:
+        date_str = d.isoformat()
+        weekday = d.weekday()
 
         for start_time, end_time in DAILY_TIME_SLOTS:
-            slot_id = f"{date_str}T{start_time}"
+            if (weekday, start_time) in group_classes:
+                continue
+            status = "blocked" if (weekday, start_time) in fixed else "available"
+            yield (tenant, f"{date_str}T{start_time}", date_str, start_time, end_time, status, 1)
+
+        for (wd, start_time), (end_time, capacity) in group_classes.items():
+            if wd == weekday:
+                yield (tenant, f"{date_str}T{start_time}", date_str, start_time, end_time, "available", capacity)
+
+        d += timedelta(days=1)
+
+
+def generate_slots(start=None, end=None, weeks=1, tenant=DEFAULT_TENANT):
+    """
+    產生 [start, end] 的時段，已存在的跳過（冪等）
+    沒給 end 就從 start 起算 weeks 週；都沒給就是下週一起一週（原本的行為）
+    全部在同一個交易裡 executemany，回傳 (inserted, skipped)
+    """
+    if start is None:
+        start = get_next_week_dates()[0].date()
+    if end is None:
+        end = start + timedelta(weeks=weeks) - timedelta(days=1)
+
+    rows = list(build_slot_rows(start, end, tenant))
+
+    with transaction(tenant) as cursor:
+        cursor.executemany("""
+        INSERT OR IGNORE INTO slots (tenant, id, date, start_time, end_time, status, capacity)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        inserted = cursor.rowcount
+
+    if inserted:
+        availability_cache(tenant).clear()
+    return inserted, len(rows) - inserted
+
+
+def ensure_rolling_window(weeks, tenant=DEFAULT_TENANT):
+    """確保 tenant 從今天起 N 週都有時段；冪等，可以每次部署 / 啟動都跑"""
+    today = date.today()
+    return generate_slots(today, today + timedelta(weeks=weeks) - timedelta(days=1), tenant=tenant)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="產生可預約時段")
+    ap.add_argument("--weeks", type=int, default=1, help="產生幾週（預設 1）")
+    ap.add_argument("--start", type=date.fromisoformat, help="起始日 YYYY-MM-DD（預設下週一）")
+    ap.add_argument("--end", type=date.fromisoformat, help="結束日 YYYY-MM-DD（含）")
+    ap.add_argument("--rolling", action="store_true", help="從今天起滾動 --weeks 週")
+    ap.add_argument("--tenant", default=DEFAULT_TENANT, help=f"tenant key（預設 {DEFAULT_TENANT}）")
+    args = ap.parse_args()
 
-            status = "blocked" if is_fixed_class(date, start_time) else "available"
+    # DB_PER_TENANT 等設定可能寫在 .env
+    load_dotenv()
+    init_db(args.tenant)
+    t0 = time.perf_counter()
+    if args.rolling:
+        inserted, skipped = ensure_rolling_window(args.weeks, args.tenant)
+    else:
+        inserted, skipped = generate_slots(args.start, args.end, args.weeks, args.tenant)
+    elapsed = (time.perf_counter() - t0) * 1000
 
-            cursor.execute("""
-            INSERT OR IGNORE INTO slots (id, date, start_time, end_time, status, user_id)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """, (slot_id, date_str, start_time, end_time, status, None))
+    print(f"課表已產生完成：新增 {inserted}，略過 {skipped}（{elapsed:.1f} ms）")
 
-    conn.commit()
-    conn.close()
-    print("下週課表已產生完成")
 
 if __name__ == "__main__":
-    generate_slots()
+    main()
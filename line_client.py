@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+
+import httpx
+
+from fast_json import dumps, loads
+from metrics import counter, histogram
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.line.me"
+
+# 這些狀態碼視為暫時性錯誤，會重試
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+LINE_API_SECONDS = histogram("bot_line_api_seconds", "LINE API 每次 HTTP 呼叫的時間", ["endpoint", "status"])
+LINE_API_RETRIES = counter("bot_line_api_retries_total", "LINE API 重試次數", ["endpoint"])
+
+
+class LineApiError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"LINE API {status_code}: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class LineClient:
+    """
+    LINE Messaging API 的 async client
+
+    - 共用一個 httpx.AsyncClient，keep-alive 連線池
+    - 429 / 5xx / 連線錯誤自動重試：指數 backoff + jitter，429 優先看 Retry-After
+    - push / multicast 帶 X-Line-Retry-Key，重試不會重複送出
+    - base_url 可換成本機 stub（LINE_API_BASE_URL）
+    """
+
+    def __init__(
+        self,
+        access_token,
+        base_url=None,
+        timeout=None,
+        max_retries=None,
+        backoff=0.5,
+        max_connections=20,
+    ):
+        self.access_token = access_token
+        self.base_url = (base_url or os.getenv("LINE_API_BASE_URL", DEFAULT_BASE_URL)).rstrip("/")
+        self.timeout = timeout if timeout is not None else float(os.getenv("LINE_API_TIMEOUT", "5"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LINE_API_MAX_RETRIES", "3"))
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.requests = 0
+        self.retries = 0
+        self._client = None
+
+    # ===== API =====
+
+    async def reply_message(self, reply_token, messages):
+        await self._post("/v2/bot/message/reply", encode_body({
+            "replyToken": reply_token,
+        }, messages))
+
+    async def push_message(self, to, messages, retry_key=None):
+        await self._post("/v2/bot/message/push", encode_body({
+            "to": to,
+        }, messages), retry_key=retry_key or str(uuid.uuid4()))
+
+    async def multicast(self, to, messages, retry_key=None):
+        await self._post("/v2/bot/message/multicast", encode_body({
+            "to": list(to),
+        }, messages), retry_key=retry_key or str(uuid.uuid4()))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ===== 內部 =====
+
+    def _get_client(self):
+        # 第一次用到才建立，確保綁在目前的 event loop 上
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                headers={"Authorization": f"Bearer {self.access_token}"},
+            )
+        return self._client
+
+    async def _post(self, path, body, retry_key=None):
+        with span("line_api"):
+            return await self._send(path, body, retry_key)
+
+    async def _send(self, path, body, retry_key):
+        # body 已經序列化好，重試直接重送同一份 bytes
+        headers = {"Content-Type": "application/json"}
+        if retry_key:
+            headers["X-Line-Retry-Key"] = retry_key
+        client = self._get_client()
+        endpoint = path.rsplit("/", 1)[-1]
+
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            t0 = time.perf_counter()
+            try:
+                resp = await client.post(path, content=body, headers=headers)
+            except httpx.TransportError as e:
+                LINE_API_SECONDS.observe(time.perf_counter() - t0, endpoint, "error")
+                if attempt == self.max_retries:
+                    raise
+                delay = self._delay(attempt)
+                logger.warning("LINE API %s failed (%s), retry in %.2fs", path, e, delay)
+            else:
+                LINE_API_SECONDS.observe(time.perf_counter() - t0, endpoint, str(resp.status_code))
+                if resp.status_code < 400:
+                    return resp
+                # 409：同一個 retry key 已經成功送過
+                if resp.status_code == 409 and retry_key:
+                    return resp
+                if resp.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    raise LineApiError(resp.status_code, resp.text)
+                delay = self._delay(attempt, resp.headers.get("Retry-After"))
+                logger.warning("LINE API %s -> %s, retry in %.2fs", path, resp.status_code, delay)
+
+            self.retries += 1
+            LINE_API_RETRIES.inc(endpoint)
+            await asyncio.sleep(delay)
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * (0.5 + random.random())
+
+
+# ===== 訊息 =====
+# 直接組 API 要的 dict，不經過 SDK 的 FlexSendMessage / TextSendMessage（會把 Flex dict 轉成 model 再轉回來）
+
+
+def text_message(text, quick_reply=None):
+    message = {"type": "text", "text": text}
+    if quick_reply:
+        message["quickReply"] = quick_reply
+    return message
+
+
+def flex_message(alt_text, contents):
+    return {"type": "flex", "altText": alt_text, "contents": contents}
+
+
+def quick_reply(*labels_and_texts):
+    """quick_reply(("📅 預約", "預約"), ...)：每個按鈕送出一段文字"""
+    return {"items": [
+        {"type": "action", "action": {"type": "message", "label": label, "text": text}}
+        for label, text in labels_and_texts
+    ]}
+
+
+class RawMessage(bytes):
+    """已經序列化好的訊息 JSON（render cache 存的），送出時原樣接進 request body"""
+
+
+def to_payload(messages):
+    """SDK 的 SendMessage、dict、RawMessage，或它們的 list → API 要的 list[dict]"""
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return [
+        m.as_json_dict() if hasattr(m, "as_json_dict") else loads(m) if isinstance(m, RawMessage) else m
+        for m in messages
+    ]
+
+
+def encode_body(fields, messages):
+    """fields 加上 "messages" 序列化成 request body；RawMessage 直接接上，不再編一次"""
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    encoded = [
+        m if isinstance(m, RawMessage) else dumps(m.as_json_dict() if hasattr(m, "as_json_dict") else m)
+        for m in messages
+    ]
+    return dumps(fields)[:-1] + b',"messages":[' + b",".join(encoded) + b"]}"
@@ -0,0 +1,67 @@
+"""
+webhook 的快速解析，取代 WebhookParser.parse
+
+WebhookParser 會為每個事件建一整串 linebot.models 物件，app.py 只用到其中幾個欄位；
+這裡驗完 HMAC 簽名後 body 只解一次 JSON，每個事件轉成一個 __slots__ 的 WebhookEvent
+"""
+import base64
+import hashlib
+import hmac
+
+from linebot.exceptions import InvalidSignatureError
+
+from fast_json import loads
+
+
+class WebhookEvent:
+    """
+    app.py 用得到的欄位
+    text：文字訊息的內容，其他事件是 None；data：postback 的 data，其他事件是 None
+    """
+
+    __slots__ = ("type", "webhook_event_id", "reply_token", "user_id", "text", "data")
+
+    def __init__(self, type, webhook_event_id=None, reply_token=None, user_id=None, text=None, data=None):
+        self.type = type
+        self.webhook_event_id = webhook_event_id
+        self.reply_token = reply_token
+        self.user_id = user_id
+        self.text = text
+        self.data = data
+
+    def __repr__(self):
+        return f"WebhookEvent({self.type!r}, {self.webhook_event_id!r}, user_id={self.user_id!r})"
+
+
+def verify_signature(body, signature, channel_secret):
+    """body / channel_secret 是 bytes；和 LINE 的 X-Line-Signature 比對（固定時間比較）"""
+    digest = hmac.new(channel_secret, body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
+
+def parse_events(body, signature, channel_secret):
+    """驗簽後回傳 [WebhookEvent, ...]；簽名不對丟 InvalidSignatureError（和 WebhookParser 一樣）"""
+    if not verify_signature(body, signature, channel_secret):
+        raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+    return [_event(raw) for raw in loads(body).get("events", ())]
+
+
+def _event(raw):
+    event_type = raw.get("type")
+    text = data = None
+
+    if event_type == "message":
+        message = raw.get("message") or {}
+        if message.get("type") == "text":
+            text = message.get("text")
+    elif event_type == "postback":
+        data = (raw.get("postback") or {}).get("data")
+
+    return WebhookEvent(
+        event_type,
+        webhook_event_id=raw.get("webhookEventId"),
+        reply_token=raw.get("replyToken"),
+        user_id=(raw.get("source") or {}).get("userId"),
+        text=text,
+        data=data,
+    )
@@ -0,0 +1,378 @@
+"""
+本機的 LINE Messaging API 替身，壓測 / 離線開發用
+
+    python line_stub.py --port 8081 --latency-ms 30 --rate-429 0.05 --rate-5xx 0.02
+    LINE_API_BASE_URL=http://127.0.0.1:8081 uvicorn app:app
+    LINE_API_BASE_URL=http://127.0.0.1:8081 python cron_reminder.py
+
+- reply / push / multicast / profile，訊息照 LINE 的規則檢查（Flex 結構、長度上限），
+  不合格回 400 和 LINE 一樣的 details
+- 可以注入延遲、429（帶 Retry-After）、5xx，量吞吐量和重試行為
+- X-Line-Retry-Key 成功過的再送一次回 409，和正式 API 一樣
+- reply 的內容依 replyToken 留下來，壓測可以照 bot 實際回的按鈕走下一步
+- GET /_stub/stats 看計數
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {
+    "/v2/bot/message/reply": "reply",
+    "/v2/bot/message/push": "push",
+    "/v2/bot/message/multicast": "multicast",
+}
+
+PROFILE_PREFIX = "/v2/bot/profile/"
+
+# ===== 訊息檢查（LINE Messaging API 的上限） =====
+
+MAX_MESSAGES = 5
+MAX_MULTICAST = 500
+MAX_TEXT = 5000
+MAX_ALT_TEXT = 1500
+MAX_CAROUSEL = 12
+MAX_QUICK_REPLY = 13
+MAX_POSTBACK_DATA = 300
+MAX_ACTION_TEXT = 300
+MAX_LABEL = 40
+
+MESSAGE_TYPES = {"text", "flex", "image", "video", "audio", "location", "sticker", "template", "imagemap"}
+COMPONENT_TYPES = {"box", "button", "image", "icon", "text", "span", "separator", "filler", "video"}
+ACTION_TYPES = {"postback", "message", "uri", "datetimepicker", "camera", "cameraRoll", "location",
+                "richmenuswitch", "clipboard"}
+BOX_LAYOUTS = {"horizontal", "vertical", "baseline"}
+BUBBLE_BLOCKS = ("header", "hero", "body", "footer")
+
+
+def validate_messages(messages, prop="messages"):
+    """回傳錯誤的 [{"message", "property"}, ...]，沒問題回傳空 list"""
+    errors = []
+
+    def error(message, where):
+        errors.append({"message": message, "property": where})
+
+    if not isinstance(messages, list) or not messages:
+        error("must be a non-empty array", prop)
+        return errors
+    if len(messages) > MAX_MESSAGES:
+        error(f"size must be between 1 and {MAX_MESSAGES}", prop)
+
+    for i, msg in enumerate(messages):
+        where = f"{prop}[{i}]"
+        if not isinstance(msg, dict) or msg.get("type") not in MESSAGE_TYPES:
+            error("invalid message type", f"{where}.type")
+            continue
+
+        if msg["type"] == "text":
+            text = msg.get("text")
+            if not isinstance(text, str) or not text:
+                error("may not be empty", f"{where}.text")
+            elif len(text) > MAX_TEXT:
+                error(f"size must be between 1 and {MAX_TEXT}", f"{where}.text")
+
+        if msg["type"] == "flex":
+            alt_text = msg.get("altText")
+            if not isinstance(alt_text, str) or not alt_text:
+                error("may not be empty", f"{where}.altText")
+            elif len(alt_text) > MAX_ALT_TEXT:
+                error(f"size must be between 1 and {MAX_ALT_TEXT}", f"{where}.altText")
+            _validate_container(msg.get("contents"), f"{where}.contents", error)
+
+        quick_reply = msg.get("quickReply")
+        if quick_reply is not None:
+            items = quick_reply.get("items") if isinstance(quick_reply, dict) else None
+            if not isinstance(items, list) or not 1 <= len(items) <= MAX_QUICK_REPLY:
+                error(f"size must be between 1 and {MAX_QUICK_REPLY}", f"{where}.quickReply.items")
+            else:
+                for j, item in enumerate(items):
+                    _validate_action(item.get("action"), f"{where}.quickReply.items[{j}].action", error)
+
+    return errors
+
+
+def _validate_container(node, where, error):
+    if not isinstance(node, dict):
+        error("must be a bubble or carousel", where)
+        return
+
+    if node.get("type") == "carousel":
+        bubbles = node.get("contents")
+        if not isinstance(bubbles, list) or not 1 <= len(bubbles) <= MAX_CAROUSEL:
+            error(f"size must be between 1 and {MAX_CAROUSEL}", f"{where}.contents")
+            return
+        for i, bubble in enumerate(bubbles):
+            if not isinstance(bubble, dict) or bubble.get("type") != "bubble":
+                error("must be a bubble", f"{where}.contents[{i}]")
+            else:
+                _validate_bubble(bubble, f"{where}.contents[{i}]", error)
+    elif node.get("type") == "bubble":
+        _validate_bubble(node, where, error)
+    else:
+        error("must be a bubble or carousel", f"{where}.type")
+
+
+def _validate_bubble(bubble, where, error):
+    if not any(bubble.get(block) for block in BUBBLE_BLOCKS):
+        error("bubble must have at least one block", where)
+    for block in BUBBLE_BLOCKS:
+        if bubble.get(block) is not None:
+            _validate_component(bubble[block], f"{where}.{block}", error)
+
+
+def _validate_component(node, where, error):
+    if not isinstance(node, dict) or node.get("type") not in COMPONENT_TYPES:
+        error("invalid component type", f"{where}.type")
+        return
+
+    kind = node["type"]
+    if kind == "box":
+        if node.get("layout") not in BOX_LAYOUTS:
+            error("invalid layout", f"{where}.layout")
+        contents = node.get("contents")
+        if not isinstance(contents, list):
+            error("must be an array", f"{where}.contents")
+            return
+        for i, child in enumerate(contents):
+            _validate_component(child, f"{where}.contents[{i}]", error)
+    elif kind == "text":
+        if not node.get("text") and not node.get("contents"):
+            error("may not be empty", f"{where}.text")
+    elif kind == "button":
+        _validate_action(node.get("action"), f"{where}.action", error)
+    elif kind == "image" and not node.get("url"):
+        error("may not be empty", f"{where}.url")
+
+    if kind != "button" and node.get("action") is not None:
+        _validate_action(node["action"], f"{where}.action", error)
+
+
+def _validate_action(action, where, error):
+    if not isinstance(action, dict) or action.get("type") not in ACTION_TYPES:
+        error("invalid action type", f"{where}.type")
+        return
+
+    label = action.get("label")
+    if label is not None and len(label) > MAX_LABEL:
+        error(f"size must be between 0 and {MAX_LABEL}", f"{where}.label")
+
+    if action["type"] == "postback":
+        data = action.get("data")
+        if not isinstance(data, str) or not 1 <= len(data) <= MAX_POSTBACK_DATA:
+            error(f"size must be between 1 and {MAX_POSTBACK_DATA}", f"{where}.data")
+    elif action["type"] == "message":
+        text = action.get("text")
+        if not isinstance(text, str) or not 1 <= len(text) <= MAX_ACTION_TEXT:
+            error(f"size must be between 1 and {MAX_ACTION_TEXT}", f"{where}.text")
+
+# ===== server =====
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive，跟真的 API 一樣可以重用連線
+
+    def do_GET(self):
+        if self.path == "/_stub/stats":
+            return self._send(200, self.server.stats())
+
+        if self.path.startswith(PROFILE_PREFIX):
+            if self._inject_fault("profile"):
+                return
+            user_id = self.path[len(PROFILE_PREFIX):]
+            self.server.record("profile")
+            return self._send(200, {
+                "userId": user_id,
+                "displayName": f"User {user_id[-4:]}",
+                "pictureUrl": f"https://example.invalid/{user_id}.png",
+                "statusMessage": "",
+                "language": "zh-TW",
+            })
+
+        self._send(404, {"message": "Not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        kind = ENDPOINTS.get(self.path)
+
+        if kind is None:
+            return self._send(404, {"message": "Not found"})
+        if self._inject_fault(kind):
+            return
+
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self._send(400, {"message": "The request body has 1 error(s)"})
+
+        details = self._validate(kind, payload)
+        if details:
+            self.server.record("invalid")
+            return self._send(400, {
+                "message": f"The request body has {len(details)} error(s)",
+                "details": details,
+            })
+
+        retry_key = self.headers.get("X-Line-Retry-Key")
+        if retry_key and not self.server.accept_retry_key(retry_key):
+            self.server.record("conflict")
+            return self._send(409, {"message": "The retry key is already accepted"})
+
+        self.server.record(kind, payload)
+        self._send(200, {})
+
+    def _validate(self, kind, payload):
+        if not isinstance(payload, dict):
+            return [{"message": "must be an object", "property": ""}]
+
+        details = validate_messages(payload.get("messages"))
+        if kind == "reply" and not payload.get("replyToken"):
+            details.append({"message": "may not be empty", "property": "replyToken"})
+        if kind == "push" and not payload.get("to"):
+            details.append({"message": "may not be empty", "property": "to"})
+        if kind == "multicast":
+            to = payload.get("to")
+            if not isinstance(to, list) or not 1 <= len(to) <= MAX_MULTICAST:
+                details.append({"message": f"size must be between 1 and {MAX_MULTICAST}", "property": "to"})
+        return details
+
+    def _inject_fault(self, kind):
+        """依設定加延遲、回 429 / 5xx；有回錯誤就回傳 True"""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        roll = random.random()
+        if roll < server.rate_429:
+            server.record("429")
+            self._send(429, {"message": "The API rate limit has been exceeded. Try again later."},
+                       headers={"Retry-After": str(server.retry_after)})
+            return True
+        if roll < server.rate_429 + server.rate_5xx:
+            server.record("5xx")
+            self._send(random.choice((500, 502, 503)), {"message": "Internal server error"})
+            return True
+        return False
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0,
+                 rate_429=0.0, rate_5xx=0.0, retry_after=0, max_replies=10000):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.max_replies = max_replies
+        self.counts = {kind: 0 for kind in (*ENDPOINTS.values(), "profile", "invalid", "conflict", "429", "5xx")}
+        self.recipients = 0
+        self._replies = OrderedDict()
+        self._retry_keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, kind, payload=None):
+        with self._lock:
+            self.counts[kind] += 1
+            if kind == "push":
+                self.recipients += 1
+            elif kind == "multicast":
+                self.recipients += len(payload["to"])
+            elif kind == "reply":
+                self._replies[payload["replyToken"]] = (time.perf_counter(), payload["messages"])
+                while len(self._replies) > self.max_replies:
+                    self._replies.popitem(last=False)
+
+    def accept_retry_key(self, retry_key):
+        """第一次看到回傳 True；成功過的 key 再來回傳 False（→ 409）"""
+        with self._lock:
+            if retry_key in self._retry_keys:
+                return False
+            self._retry_keys[retry_key] = None
+            while len(self._retry_keys) > self.max_replies:
+                self._retry_keys.popitem(last=False)
+            return True
+
+    def pop_reply(self, reply_token):
+        """取出某個 replyToken 的 (收到的 perf_counter, messages)，還沒收到回傳 None"""
+        with self._lock:
+            return self._replies.pop(reply_token, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, "recipients": self.recipients}
+
+    def start(self):
+        """在背景 thread 跑（給 bench 用），回傳 base URL"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_fault_arguments(ap):
+    """延遲 / 錯誤注入的 CLI 參數，line_stub 和 bench 共用"""
+    ap.add_argument("--latency-ms", type=float, default=0, help="每個呼叫固定延遲")
+    ap.add_argument("--jitter-ms", type=float, default=0, help="再加 0～N ms 的隨機延遲")
+    ap.add_argument("--rate-429", type=float, default=0, help="回 429 的機率（0～1）")
+    ap.add_argument("--rate-5xx", type=float, default=0, help="回 500/502/503 的機率（0～1）")
+    ap.add_argument("--retry-after", type=int, default=0, help="429 的 Retry-After 秒數")
+
+
+def fault_options(args):
+    return {
+        "latency_ms": args.latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "rate_429": args.rate_429,
+        "rate_5xx": args.rate_5xx,
+        "retry_after": args.retry_after,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="本機 LINE Messaging API stub")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    add_fault_arguments(ap)
+    args = ap.parse_args()
+
+    server = StubServer(args.host, args.port, **fault_options(args))
+    print(f"LINE stub listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+from db import DEFAULT_TENANT, get_connection, transaction
+from fanout import fan_out
+from line_client import LineApiError, RETRY_STATUS
+
+logger = logging.getLogger(__name__)
+
+# 環境變數在用到時才讀：entry point 的 load_dotenv() 在 import outbox 之後才跑，import 時讀不到 .env
+# OUTBOX_BATCH_SIZE     一次領幾筆（預設 50）
+# OUTBOX_MAX_ATTEMPTS   失敗幾次後變 dead（預設 8）
+# OUTBOX_BACKOFF        第 n 次失敗後等 backoff * 2^(n-1) 秒（預設 5）
+# OUTBOX_POLL_INTERVAL  drainer 沒有訊息時隔幾秒再看（預設 2）
+# OUTBOX_RATE           每秒 API 呼叫數上限（預設 20）
+# OUTBOX_CONCURRENCY    同時送出的請求數上限（預設 10）
+
+# 領走後沒回報結果（drainer 當掉）的訊息，過了這段時間會被重新領取
+OUTBOX_LEASE = 60
+
+
+def _claim(batch_size, tenant):
+    """領取 tenant 一批到期的訊息，標成 sending 並給一段 lease；多個 worker 同時跑也不會領到同一筆"""
+    conn = get_connection(tenant)
+    now = time.time()
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("""
+            SELECT id, recipient, payload, attempts
+            FROM outbox
+            WHERE tenant = ?
+              AND status IN ('pending', 'sending')
+              AND next_attempt_at <= ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        """, (tenant, now, batch_size)).fetchall()
+
+        conn.executemany("""
+            UPDATE outbox
+            SET status = 'sending',
+                attempts = attempts + 1,
+                next_attempt_at = ?
+            WHERE id = ?
+        """, [(now + OUTBOX_LEASE, row[0]) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return rows
+
+
+def _retry_key(row_id, tenant):
+    """outbox 每一筆固定的 X-Line-Retry-Key：lease 過期被重新領取時 LINE 會認出是同一則，不會再送一次"""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"outbox:{tenant}:{row_id}"))
+
+
+def _is_permanent(error):
+    return isinstance(error, LineApiError) and error.status_code not in RETRY_STATUS
+
+
+def _finish(rows, errors, tenant):
+    """依送出結果更新狀態：sent / 排下一次重試 / dead"""
+    max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    backoff = float(os.getenv("OUTBOX_BACKOFF", "5"))
+    now = time.time()
+
+    with transaction(tenant) as cur:
+        for i, (row_id, _, _, attempts) in enumerate(rows):
+            attempts += 1
+            error = errors.get(i)
+
+            if error is None:
+                cur.execute("""
+                    UPDATE outbox
+                    SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ?
+                """, (row_id,))
+            elif _is_permanent(error) or attempts >= max_attempts:
+                cur.execute("""
+                    UPDATE outbox
+                    SET status = 'dead', last_error = ?
+                    WHERE id = ?
+                """, (str(error), row_id))
+            else:
+                cur.execute("""
+                    UPDATE outbox
+                    SET status = 'pending', next_attempt_at = ?, last_error = ?
+                    WHERE id = ?
+                """, (now + backoff * 2 ** (attempts - 1), str(error), row_id))
+
+
+async def drain_once(line_client, tenant=DEFAULT_TENANT, batch_size=None):
+    """
+    用 tenant 的 client 送出一批到期的訊息，回傳 fan_out 的統計（沒有到期的訊息回傳 None）
+    相同內容的收件人會合併成 multicast；每筆帶固定的 retry key，重新領取時不會重複送出
+    """
+    if batch_size is None:
+        batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+    rows = await asyncio.to_thread(_claim, batch_size, tenant)
+    if not rows:
+        return None
+
+    jobs = [
+        (recipient, json.loads(payload), _retry_key(row_id, tenant))
+        for row_id, recipient, payload, _ in rows
+    ]
+    stats = await fan_out(
+        line_client, jobs,
+        rate=float(os.getenv("OUTBOX_RATE", "20")),
+        concurrency=int(os.getenv("OUTBOX_CONCURRENCY", "10")),
+    )
+
+    await asyncio.to_thread(_finish, rows, stats["errors"], tenant)
+    return stats
+
+
+async def drain(line_client, tenant=DEFAULT_TENANT):
+    """把 tenant 目前到期的訊息送完（排程工作用），回傳累計的 sent / failed / retried / requests"""
+    total = {"sent": 0, "failed": 0, "retried": 0, "requests": 0}
+
+    while True:
+        stats = await drain_once(line_client, tenant)
+        if stats is None:
+            return total
+        for key in total:
+            total[key] += stats[key]
+
+
+async def run_drainer(line_client, tenant=DEFAULT_TENANT, interval=None):
+    """tenant 常駐的背景 drainer：有訊息就一直送，沒有就每 interval 秒（預設 OUTBOX_POLL_INTERVAL）看一次"""
+    if interval is None:
+        interval = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+    while True:
+        try:
+            stats = await drain_once(line_client, tenant)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("outbox drain failed")
+            stats = None
+
+        if stats is None:
+            await asyncio.sleep(interval)
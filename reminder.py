@@ -1,12 +1,10 @@
-from datetime import datetime
-from linebot.models import FlexSendMessage
+from date_labels import display_date
+from db import DEFAULT_TENANT, transaction, enqueue_outbox
+from line_client import flex_message
+from outbox import drain
 
 
 def build_reminder_flex(slot_id, date, start, end):
-    dt = datetime.strptime(date, "%Y-%m-%d")
-    weekday = ["一", "二", "三", "四", "五", "六", "日"][dt.weekday()]
-    display_date = f"{dt.month}/{dt.day}（週{weekday}）"
-
     return {
         "type": "bubble",
         "body": {
@@ -22,7 +20,7 @@ def build_reminder_flex(slot_id, date, start, end):
                 },
                 {
                     "type": "text",
-                    "text": f"📅 {display_date}\n⏰ {start}–{end}",
+                    "text": f"📅 {display_date(date)}\n⏰ {start}–{end}",
                     "wrap": True
                 },
                 {
@@ -61,15 +59,30 @@ def build_reminder_flex(slot_id, date, start, end):
     }
 
 
-def send_reminder(line_bot_api, bookings):
-    for user_id, date, start, end in bookings:
-        slot_id = f"{date}T{start}-{end}"
-        flex = build_reminder_flex(slot_id, date, start, end)
-
-        line_bot_api.push_message(
-            user_id,
-            FlexSendMessage(
-                alt_text="明天上課提醒",
-                contents=flex
+def enqueue_reminders(bookings, tenant=DEFAULT_TENANT):
+    """
+    把提醒寫進 outbox，回傳新寫入的筆數
+    bookings: get_tomorrow_bookings 的 (user_id, date, start, end, sid)
+    dedupe_key 以學員 + 時段為準，排程重跑也不會重複提醒（沿用 sid 以前的格式，升級當天也不會重送）
+    """
+    count = 0
+    with transaction(tenant) as cur:
+        for user_id, date, start, end, slot_id in bookings:
+            flex = build_reminder_flex(slot_id, date, start, end)
+            count += enqueue_outbox(
+                cur,
+                user_id,
+                flex_message("明天上課提醒", flex),
+                dedupe_key=f"reminder:{user_id}:{date}T{start}-{end}",
+                tenant=tenant,
             )
-        )
+    return count
+
+
+async def send_reminder(line_client, bookings, tenant=DEFAULT_TENANT):
+    """
+    提醒寫進 outbox 後立刻送出（同一時段的學員合併成 multicast）
+    回傳 outbox.drain 的統計 {"sent", "failed", "retried", "requests"}
+    """
+    enqueue_reminders(bookings, tenant)
+    return await drain(line_client, tenant)
@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+from fast_json import dumps
+from line_client import RawMessage
+
+
+class RenderCache:
+    """
+    Flex 訊息的 render 快取：key -> 序列化好的訊息（RawMessage），LRU 淘汰
+
+    - key 由呼叫端組：(builder, tenant, 日期, availability version[, today])，
+      資料有寫入時 version 會變，舊的 key 不會再被用到，留著等 LRU 淘汰就好
+    - 存的是 bytes，送出時直接接進 request body，不用重建 dict 也不用再序列化
+    - max_size=0 等於關閉（照樣序列化，只是不存）
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            message = self._items.get(key)
+            if message is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return message
+
+    def put(self, key, message):
+        """message 是訊息 dict，回傳序列化後的 RawMessage"""
+        raw = RawMessage(dumps(message))
+        if self.max_size <= 0:
+            return raw
+        with self._lock:
+            self._items[key] = raw
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return raw
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._items)}
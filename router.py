@@ -0,0 +1,171 @@
+"""
+postback / 文字指令的路由表
+
+- 前綴（postback 的 "DATE|..."、文字的第一個字）查一次 dict 找 handler
+- payload 在這裡解析一次成有型別的物件，handler 不用再自己 split
+- 沒有 handler、格式不對、非教練用教練指令都記到 bot_unhandled_actions_total
+"""
+import logging
+from datetime import date
+from typing import Callable, NamedTuple, Union
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+UNHANDLED = metrics.counter(
+    "bot_unhandled_actions_total", "沒有處理的 postback / 文字指令", ["kind", "action", "reason"]
+)
+# 舊格式（sid 以前）的時段 postback 還有多少，歸零之後就可以拿掉相容的解析
+LEGACY_SLOTS = metrics.counter("bot_legacy_slot_postbacks_total", "舊格式（date + 時間）的時段 postback")
+
+# ===== Payload =====
+
+
+class DatePayload(NamedTuple):
+    """DATE|YYYY-MM-DD"""
+    date: str
+
+    @classmethod
+    def decode(cls, raw):
+        date.fromisoformat(raw)   # 格式不對丟 ValueError
+        return cls(raw)
+
+
+class DatePagePayload(NamedTuple):
+    """DATE_PAGE|n|cursor：第 n 頁，cursor 是上一頁最後一天（第一頁沒有 cursor）"""
+    page: int
+    after: str
+
+    @classmethod
+    def decode(cls, raw):
+        page, _, after = raw.partition("|")
+        page = int(page)
+        if page < 1 or (page > 1) != bool(after):
+            raise ValueError(raw)
+        if after:
+            date.fromisoformat(after)
+        return cls(page, after or None)
+
+
+class DayPagePayload(NamedTuple):
+    """DAY_PAGE|YYYY-MM-DD|HH:MM：當天 cursor 之後的時段"""
+    date: str
+    after: str
+
+    @classmethod
+    def decode(cls, raw):
+        day, after = raw.split("|", 1)
+        date.fromisoformat(day)
+        if not after:
+            raise ValueError(raw)
+        return cls(day, after)
+
+
+class SlotPayload(NamedTuple):
+    """
+    SLOT| / CONFIRM| / CANCEL_*| / REMINDER_*| 的時段：slots.sid
+    聊天室裡還留著的舊按鈕帶的是 YYYY-MM-DDTHH:MM-HH:MM（CANCEL_* 是 date|start|end），
+    統一成 YYYY-MM-DDTHH:MM-HH:MM 字串放在 slot，交給 db 用 date + 時間查
+    """
+    slot: Union[int, str]   # int：sid；str：舊格式
+
+    @classmethod
+    def decode(cls, raw):
+        if raw.isdigit():
+            return cls(int(raw))
+
+        parts = raw.split("|")
+        if len(parts) == 3:
+            day, start, end = parts
+        else:
+            day, time_range = raw.split("T", 1)
+            start, end = time_range.split("-", 1)
+        date.fromisoformat(day)   # 格式不對丟 ValueError
+        LEGACY_SLOTS.inc()
+        return cls(f"{day}T{start}-{end}")
+
+
+class BackPayload(NamedTuple):
+    """BACK|DATE：回到某一步"""
+    target: str
+
+    @classmethod
+    def decode(cls, raw):
+        if raw != "DATE":
+            raise ValueError(raw)
+        return cls(raw)
+
+
+def args_payload(raw):
+    """文字指令後面的參數（以空白分開）"""
+    return tuple(raw.split())
+
+
+def no_payload(raw):
+    """不帶參數的指令；多了東西就算格式不對"""
+    if raw:
+        raise ValueError(raw)
+    return None
+
+# ===== Router =====
+
+
+class Route(NamedTuple):
+    handler: Callable
+    decode: Callable
+    coach_only: bool
+
+
+class Router:
+    """
+    kind：metrics 的 label（postback / message）
+    separator：前綴和 payload 之間的分隔（None = 空白）
+    fallback：沒對到 route 時呼叫 fallback(user_id, tenant)，沒有就回傳 None
+    """
+
+    def __init__(self, kind, separator=None, fallback=None):
+        self.kind = kind
+        self.separator = separator
+        self.fallback = fallback
+        self.routes = {}
+
+    def route(self, action, decode=no_payload, coach_only=False):
+        def register(handler):
+            self.routes[action] = Route(handler, decode, coach_only)
+            return handler
+        return register
+
+    def split(self, raw):
+        """(前綴, 後面的 payload)"""
+        parts = raw.split(self.separator, 1)
+        if not parts:
+            return "", ""
+        return parts[0], parts[1] if len(parts) > 1 else ""
+
+    def label(self, raw):
+        """metrics 用：有註冊的前綴原樣回傳，其他一律 other"""
+        action, _ = self.split(raw)
+        return action if action in self.routes else "other"
+
+    def dispatch(self, raw, user_id, tenant):
+        """回傳 handler 的結果；沒有 handler 時交給 fallback"""
+        action, rest = self.split(raw)
+        route = self.routes.get(action)
+
+        if route is None:
+            return self._unhandled("unknown", "unknown", user_id, tenant)
+        if route.coach_only and user_id not in tenant.coach_ids:
+            return self._unhandled(action, "forbidden", user_id, tenant)
+
+        try:
+            payload = route.decode(rest)
+        except ValueError:
+            logger.info("invalid %s payload: %r", self.kind, raw)
+            return self._unhandled(action, "invalid", user_id, tenant)
+
+        return route.handler(payload, user_id, tenant)
+
+    def _unhandled(self, action, reason, user_id, tenant):
+        UNHANDLED.inc(self.kind, action, reason)
+        return self.fallback(user_id, tenant) if self.fallback else None
@@ -0,0 +1,87 @@
+"""
+同一個 webhook 裡所有事件要讀的資料，先一起查好（每種資料一條 IN 查詢）
+
+- DATE|<date> 要的可預約時段、「取消」要的已預約課程，依不重複的日期 / 學員一次查完，
+  事件再多，查詢次數只跟不重複的 key 有關
+- 用 availability cache 的 version 判斷還能不能用：查完之後有任何寫入（訂位、取消、暫留，
+  或別的 worker 寫過）version 就會變，這時改回直接查 DB，不會讀到舊資料
+- handler 透過 available_slots() / booked_slots() 讀；沒有 snapshot（只有一個事件）時就是原本的查詢
+"""
+import contextvars
+from contextlib import contextmanager
+
+from db import (
+    availability_version,
+    get_available_slots_by_date,
+    get_available_slots_for_dates,
+    get_user_booked_slots,
+    get_user_booked_slots_for_users,
+)
+from router import DatePayload
+
+_current = contextvars.ContextVar("snapshot", default=None)
+
+
+class DeliverySnapshot:
+    def __init__(self, tenant, version, slots, booked):
+        self.tenant = tenant
+        self.version = version
+        self.slots = slots      # date -> 可預約時段
+        self.booked = booked    # user_id -> 已預約課程
+
+    @classmethod
+    def load(cls, tenant, events):
+        """
+        看這批事件要讀什麼，一起查好；用得到的事件不到兩個就回傳 None（分開查也一樣）
+        會查 SQLite，async 程式請丟到 threadpool
+        """
+        dates, users = set(), set()
+        wanted = 0
+        for event in events:
+            if event.data is not None and event.data.startswith("DATE|"):
+                try:
+                    dates.add(DatePayload.decode(event.data[5:]).date)
+                except ValueError:
+                    continue
+                wanted += 1
+            elif event.text is not None and event.text.strip() == "取消" and event.user_id:
+                users.add(event.user_id)
+                wanted += 1
+
+        if wanted < 2:
+            return None
+
+        # version 要在查詢之前拿，查的途中有人寫入也會判斷成失效
+        return cls(
+            tenant,
+            availability_version(tenant),
+            get_available_slots_for_dates(dates, tenant) if dates else {},
+            get_user_booked_slots_for_users(users, tenant) if users else {},
+        )
+
+    def valid(self):
+        return availability_version(self.tenant) == self.version
+
+
+@contextmanager
+def use_snapshot(snapshot):
+    """這段處理期間 available_slots() / booked_slots() 先讀 snapshot"""
+    token = _current.set(snapshot)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def available_slots(date, tenant):
+    snapshot = _current.get()
+    if snapshot is not None and snapshot.tenant == tenant and date in snapshot.slots and snapshot.valid():
+        return list(snapshot.slots[date])
+    return get_available_slots_by_date(date, tenant=tenant)
+
+
+def booked_slots(user_id, tenant):
+    snapshot = _current.get()
+    if snapshot is not None and snapshot.tenant == tenant and user_id in snapshot.booked and snapshot.valid():
+        return list(snapshot.booked[user_id])
+    return get_user_booked_slots(user_id, tenant=tenant)
@@ -0,0 +1,61 @@
+import os
+import re
+
+from db import DEFAULT_TENANT, OPEN_WEEKDAYS
+from line_client import LineClient
+
+# 原本寫死在 app.py / cron_reminder.py 的教練
+DEFAULT_COACH_IDS = "U17fdee62c51888ebea77d8b696eb38e4"
+
+# tenant key 會用在 URL 和 DB 檔名，限制字元
+TENANT_KEY_RE = re.compile(r"^[a-z0-9_]+$")
+
+
+class Tenant:
+    """一個教練 / 場館：自己的 LINE channel、教練名單、預設開課星期"""
+
+    def __init__(self, key, channel_secret, access_token, coach_ids, open_weekdays=OPEN_WEEKDAYS):
+        self.key = key
+        self.coach_ids = frozenset(coach_ids)
+        self.open_weekdays = frozenset(open_weekdays)
+        self.channel_secret = (channel_secret or "").encode("utf-8")
+        self.line_client = LineClient(access_token)
+
+
+def _env(name, key, default=None):
+    """default tenant 讀 NAME，其他 tenant 讀 NAME__<KEY>（例如 COACH_IDS__STUDIO_B）"""
+    if key == DEFAULT_TENANT:
+        return os.getenv(name, default)
+    return os.getenv(f"{name}__{key.upper()}", default)
+
+
+def _split(value):
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+
+def load_tenants():
+    """
+    從環境變數讀出所有 tenant，回傳 {key: Tenant}
+    要在 load_dotenv() 之後呼叫
+
+    TENANTS=default,studio_b（沒設就只有 default）
+    每個 tenant：LINE_CHANNEL_SECRET / LINE_CHANNEL_ACCESS_TOKEN / COACH_IDS / OPEN_WEEKDAYS
+    """
+    tenants = {}
+
+    for key in _split(os.getenv("TENANTS", DEFAULT_TENANT)):
+        if not TENANT_KEY_RE.match(key):
+            raise ValueError(f"tenant key 只能用小寫英數和底線：{key!r}")
+
+        default_coaches = DEFAULT_COACH_IDS if key == DEFAULT_TENANT else ""
+        weekdays = _env("OPEN_WEEKDAYS", key)
+
+        tenants[key] = Tenant(
+            key,
+            channel_secret=_env("LINE_CHANNEL_SECRET", key),
+            access_token=_env("LINE_CHANNEL_ACCESS_TOKEN", key),
+            coach_ids=_split(_env("COACH_IDS", key, default_coaches)),
+            open_weekdays={int(d) for d in _split(weekdays)} if weekdays else OPEN_WEEKDAYS,
+        )
+
+    return tenants
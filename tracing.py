@@ -0,0 +1,233 @@
+"""
+事件處理的分段計時（trace / span）與抽樣 profile，預設全關
+
+- trace()：包住一個事件；span() / @traced 把各階段（parse、sqlite、flex、line_api）的時間記在上面，
+  超過 TRACE_SLOW_MS 的寫一行 JSON log（logger "tracing"），看得出時間花在哪
+- 沒有 trace 時 span() 什麼都不做；handler 丟到 threadpool 也記得到（contextvar 會複製過去）
+- profile：每 PROFILE_EVERY 個事件抽一個（或 webhook 帶 X-Profile: <PROFILE_TOKEN> 指定），
+  事件處理期間每 PROFILE_INTERVAL_MS 抓一次所有 thread 的 stack，存成 folded stacks
+  （flamegraph.pl / speedscope 可以直接讀）
+  handler 跑在 threadpool，cProfile 只看得到 event loop 那條 thread，所以用取樣；
+  同時間在跑的其他事件也會被抓進來
+- 設定從環境變數讀：entry point 在 load_dotenv() 之後呼叫 load_settings()
+- configure() 可以在執行中改門檻 / 抽樣率（app 的 /debug/tracing），不用重啟 worker
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# 0 = 關；實際值由 load_settings() 從環境變數讀
+TRACE_SLOW_MS = 0.0
+PROFILE_EVERY = 0
+PROFILE_TOKEN = ""
+PROFILE_DIR = "profiles"
+PROFILE_INTERVAL_MS = 1.0
+
+logger = logging.getLogger("tracing")
+
+# 只有 repo 根目錄的模組算「自己的程式」，沒經過的 stack（閒置的 thread、event loop）不記
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_current = contextvars.ContextVar("trace", default=None)
+_NULL = nullcontext()
+_event_count = itertools.count()
+_profile_count = itertools.count()
+_forced = set()
+_sampler_lock = threading.Lock()
+
+
+def load_settings():
+    """
+    從環境變數讀門檻 / 抽樣設定
+    要在 load_dotenv() 之後呼叫（import 時 .env 還沒載入，讀不到裡面的值）
+    """
+    global TRACE_SLOW_MS, PROFILE_EVERY, PROFILE_TOKEN, PROFILE_DIR, PROFILE_INTERVAL_MS
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+    PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "0"))
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+
+
+def configure(slow_ms=None, profile_every=None):
+    """執行中調整（只影響目前這個 worker）"""
+    global TRACE_SLOW_MS, PROFILE_EVERY
+    if slow_ms is not None:
+        TRACE_SLOW_MS = float(slow_ms)
+    if profile_every is not None:
+        PROFILE_EVERY = int(profile_every)
+    return {"slow_ms": TRACE_SLOW_MS, "profile_every": PROFILE_EVERY}
+
+# ===== trace / span =====
+
+
+class Trace:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.spans = {}
+        self.depth = 0
+        self.start = time.perf_counter()
+
+    def add(self, phase, seconds):
+        self.spans[phase] = self.spans.get(phase, 0.0) + seconds
+
+
+class _Span:
+    __slots__ = ("trace", "phase", "t0")
+
+    def __init__(self, trace, phase):
+        self.trace = trace
+        self.phase = phase
+        self.t0 = None
+
+    def __enter__(self):
+        # 巢狀的 span（book_slot 裡的 enqueue_outbox、dedup 裡的 sqlite）只算最外層，各階段加起來不會超過總時間
+        self.trace.depth += 1
+        if self.trace.depth == 1:
+            self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.depth -= 1
+        if self.t0 is not None:
+            self.trace.add(self.phase, time.perf_counter() - self.t0)
+
+
+def span(phase):
+    t = _current.get()
+    return _NULL if t is None else _Span(t, phase)
+
+
+def traced(phase):
+    """decorator：函式的執行時間記到目前 trace 的 phase"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t = _current.get()
+            if t is None:
+                return fn(*args, **kwargs)
+            with _Span(t, phase):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(name, profile=False, **fields):
+    """
+    包住一段處理；慢的（或有 profile 的）結束時寫一行 JSON log
+    profile 由呼叫端用 should_profile() 決定
+    """
+    sampler = Sampler.start(name) if profile else None
+    if TRACE_SLOW_MS <= 0 and sampler is None:
+        yield None
+        return
+
+    t = Trace(name, fields)
+    token = _current.set(t)
+    try:
+        yield t
+    finally:
+        _current.reset(token)
+        elapsed = time.perf_counter() - t.start
+        path = sampler.stop() if sampler else None
+        if path or elapsed * 1000 >= TRACE_SLOW_MS > 0:
+            _log(t, elapsed, path)
+
+
+def _log(t, elapsed, path):
+    spans = {k: round(v * 1000, 2) for k, v in sorted(t.spans.items())}
+    spans["other"] = round(max(0.0, elapsed - sum(t.spans.values())) * 1000, 2)
+    record = {"trace": t.name, "ms": round(elapsed * 1000, 2), **t.fields, "spans": spans}
+    if path:
+        record["profile"] = path
+    logger.warning(json.dumps(record, ensure_ascii=False))
+
+# ===== profile =====
+
+
+def force_profile(key):
+    """下一次 should_profile(key) 一定抽中（webhook 帶 X-Profile 時用）"""
+    _forced.add(key)
+
+
+def should_profile(key=None):
+    if key is not None and key in _forced:
+        _forced.discard(key)
+        return True
+    return PROFILE_EVERY > 0 and next(_event_count) % PROFILE_EVERY == 0
+
+
+def check_token(value):
+    return bool(PROFILE_TOKEN) and value == PROFILE_TOKEN
+
+
+class Sampler:
+    """背景 thread 定期抓 sys._current_frames()，同一時間只跑一個"""
+
+    def __init__(self, name, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.path = os.path.join(
+            PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}-{next(_profile_count)}.folded"
+        )
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    @classmethod
+    def start(cls, name):
+        """已經有一個在跑就回傳 None（不疊加）"""
+        if not _sampler_lock.acquire(blocking=False):
+            return None
+        sampler = cls(name, PROFILE_INTERVAL_MS / 1000)
+        sampler._thread.start()
+        return sampler
+
+    def stop(self):
+        """停止取樣，回傳輸出檔路徑；寫檔在 sampler thread 做，不卡 event loop"""
+        self._stop.set()
+        return self.path
+
+    def _run(self):
+        me = threading.get_ident()
+        try:
+            while not self._stop.wait(self.interval):
+                for tid, frame in sys._current_frames().items():
+                    if tid != me:
+                        stack = _folded(frame)
+                        if stack:
+                            self.stacks[stack] += 1
+            self._save()
+        finally:
+            _sampler_lock.release()
+
+    def _save(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        top = ", ".join(f"{name} x{count}" for name, count in leaves.most_common(5))
+        logger.warning("profile saved %s (%d samples): %s", self.path, sum(self.stacks.values()), top)
+
+
+def _folded(frame):
+    names = []
+    ours = False
+    while frame is not None:
+        code = frame.f_code
+        ours = ours or os.path.dirname(code.co_filename) == ROOT
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names)) if ours else None